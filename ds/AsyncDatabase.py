@@ -0,0 +1,203 @@
+from .Database import Database
+from .constants import CACHE_MAX_BYTES, IO_WORKERS, IO_POOL_KIND, SCAN_BATCH_SIZE, ASYNC_MAX_CONCURRENCY, FSYNC_POLICY, FSYNC_INTERVAL_MS
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+
+
+# Facade of Database for asyncio applications. Every call runs in a thread of
+# its own executor, at most 'max_concurrency' at a time, so the event loop is
+# never blocked by the file I/O. The results keep the (status, payload)
+# conventions of Database.
+#
+# Identical reads issued while one of them is running share its result, as
+# long as no write to the table was issued in between. The DDL commands, which
+# modify the metadata of the database, run one at a time.
+class AsyncDatabase:
+    def __init__(self, base_path, cache_bytes=CACHE_MAX_BYTES, io_workers=IO_WORKERS, io_pool=IO_POOL_KIND,
+                 max_concurrency=ASYNC_MAX_CONCURRENCY, fsync_policy=FSYNC_POLICY, fsync_interval=FSYNC_INTERVAL_MS):
+        self.database = Database(base_path, cache_bytes, io_workers, io_pool, fsync_policy, fsync_interval)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='AsyncDatabase')
+        self.semaphore = None
+        self.max_concurrency = max_concurrency
+        self.ddl_lock = None
+        self.reads = {}  # {request key: future of the running read}
+        self.generations = {}  # {table_name: writes issued to the table}
+
+    async def run(self, function, *args, **kwargs):
+        # Created on first use, inside the running loop
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def read(self, name, table_name, *args, **kwargs):
+        key = (name, table_name, self.generations.get(table_name, 0), repr(args), repr(sorted(kwargs.items())))
+        future = self.reads.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(self.run(getattr(self.database, name), table_name, *args, **kwargs))
+        self.reads[key] = future
+        future.add_done_callback(lambda _: self.reads.pop(key, None) if self.reads.get(key) is future else None)
+        return await asyncio.shield(future)
+
+    async def write(self, name, table_name, *args, **kwargs):
+        # Reads issued from now on do not join the ones already running
+        self.generations[table_name] = self.generations.get(table_name, 0) + 1
+        return await self.run(getattr(self.database, name), table_name, *args, **kwargs)
+
+    async def ddl(self, name, *args, **kwargs):
+        if self.ddl_lock is None:
+            self.ddl_lock = asyncio.Lock()
+        if args:
+            self.generations[args[0]] = self.generations.get(args[0], 0) + 1
+        async with self.ddl_lock:
+            return await self.run(getattr(self.database, name), *args, **kwargs)
+
+    #############################
+    ###     DDL Commands      ###
+    #############################
+
+    async def create_table(self, table_name, column_families, max_versions=1, is_enabled=True, **kwargs):
+        return await self.ddl('create_table', table_name, column_families, max_versions, is_enabled, **kwargs)
+
+    async def list_tables(self):
+        return await self.ddl('list_tables')
+
+    async def disable_table(self, table_name):
+        return await self.ddl('disable_table', table_name)
+
+    async def enable_table(self, table_name):
+        return await self.ddl('enable_table', table_name)
+
+    async def describe_table(self, table_name):
+        return await self.ddl('describe_table', table_name)
+
+    async def drop_table(self, table_name):
+        return await self.ddl('drop_table', table_name)
+
+    async def drop_all_tables(self):
+        self.generations.clear()
+        return await self.ddl('drop_all_tables')
+
+    async def alter_table(self, table_name, flag, value):
+        return await self.ddl('alter_table', table_name, flag, value)
+
+    async def truncate(self, table_name):
+        return await self.ddl('truncate', table_name)
+
+    async def create_index(self, table_name, column):
+        return await self.ddl('create_index', table_name, column)
+
+    async def drop_index(self, table_name, column):
+        return await self.ddl('drop_index', table_name, column)
+
+    async def migrate_table(self, table_name, storage_format):
+        return await self.ddl('migrate_table', table_name, storage_format)
+
+    #############################
+    ###     DML Commands      ###
+    #############################
+
+    async def put(self, table_name, row_id, col_family, col_name, value):
+        return await self.write('put', table_name, row_id, col_family, col_name, value)
+
+    async def put_many(self, table_name, file_path):
+        return await self.write('put_many', table_name, file_path)
+
+    async def mutate_rows(self, table_name, mutations):
+        return await self.write('mutate_rows', table_name, mutations)
+
+    async def check_and_put(self, table_name, row_id, col_family, col_name, expected, value):
+        return await self.write('check_and_put', table_name, row_id, col_family, col_name, expected, value)
+
+    async def increment(self, table_name, row_id, col_family, col_name, delta=1):
+        return await self.write('increment', table_name, row_id, col_family, col_name, delta)
+
+    async def delete(self, table_name, row_id, col_family, col_name, version):
+        return await self.write('delete', table_name, row_id, col_family, col_name, version)
+
+    async def delete_all(self, table_name, row_id):
+        return await self.write('delete_all', table_name, row_id)
+
+    async def flush(self, table_name):
+        return await self.write('flush', table_name)
+
+    async def compact(self, table_name):
+        return await self.write('compact', table_name)
+
+    async def get(self, table_name, row_id, columns=None, versions=None, time_range=None, as_of=None):
+        return await self.read('get', table_name, row_id, columns, versions, time_range, as_of)
+
+    async def multi_get(self, table_name, row_ids, columns=None):
+        return await self.read('multi_get', table_name, row_ids, columns)
+
+    async def query_index(self, table_name, column, value, columns=None, limit=None):
+        return await self.read('query_index', table_name, column, value, columns, limit)
+
+    async def count(self, table_name, exact=False):
+        return await self.read('count', table_name, exact)
+
+    async def get_table_stats(self, table_name, exact=False):
+        return await self.read('get_table_stats', table_name, exact)
+
+    # Returns (True, async iterator over the (row_id, row)), the rows are read
+    # in the executor SCAN_BATCH_SIZE at a time
+    async def scan(self, table_name, **kwargs):
+        status, rows = await self.run(self.database.scan, table_name, **kwargs)
+        if not status:
+            return False, rows
+        return True, AsyncRows(self, rows)
+
+    def get_cache_stats(self):
+        return self.database.get_cache_stats()
+
+    def close(self):
+        self.executor.shutdown()
+        self.database.pool.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+        return False
+
+
+class AsyncRows:
+    def __init__(self, database, rows):
+        self.database = database
+        self.rows = rows
+        self.batch = []
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.batch:
+            if self.done:
+                raise StopAsyncIteration
+            self.batch = await self.database.run(readBatch, self.rows, SCAN_BATCH_SIZE)
+            self.batch.reverse()
+            if not self.batch:
+                self.done = True
+                raise StopAsyncIteration
+        return self.batch.pop()
+
+    # Stops the scan before its end
+    async def aclose(self):
+        self.done = True
+        self.batch = []
+        await self.database.run(self.rows.close)
+
+
+def readBatch(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            break
+    return batch
@@ -0,0 +1,48 @@
+# Collects the mutations of a table to apply them all at once with
+# Database.mutate_rows: every row is read once and all the mutations are
+# logged with a single write.
+#
+#   batch = database.batch('users')
+#   batch.put('u1', 'info', 'name', 'Ana')
+#   batch.delete('u2', 'info', 'name', 1)
+#   batch.delete_all('u3')
+#   status, results = batch.commit()
+class Batch:
+    def __init__(self, database, table_name):
+        self.database = database
+        self.table_name = table_name
+        self.mutations = []
+
+    def put(self, row_id, col_family, col_name, value):
+        self.mutations.append({'op': 'put', 'row': row_id, 'cf': col_family,
+                               'col': col_name, 'value': value})
+        return self
+
+    def delete(self, row_id, col_family, col_name, version):
+        self.mutations.append({'op': 'delete', 'row': row_id, 'cf': col_family,
+                               'col': col_name, 'version': version})
+        return self
+
+    def delete_all(self, row_id):
+        self.mutations.append({'op': 'delete_row', 'row': row_id})
+        return self
+
+    # Returns (status, [(status, message)] of every mutation in order), the
+    # batch is emptied once it is applied
+    def commit(self):
+        status, results = self.database.mutate_rows(self.table_name, self.mutations)
+        if status:
+            self.mutations = []
+        return status, results
+
+    def __len__(self):
+        return len(self.mutations)
+
+    def __enter__(self):
+        return self
+
+    # Commits on leaving the block unless it raised
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self.mutations:
+            self.commit()
+        return False
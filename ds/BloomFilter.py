@@ -0,0 +1,50 @@
+import base64
+import hashlib
+import math
+
+
+# Set of keys answering "maybe present" or "surely absent", sized for the
+# number of keys and the rate of false positives wanted. The positions of a
+# key are derived from two halves of a single hash (double hashing).
+class BloomFilter:
+    def __init__(self, size, hash_count, bits=None):
+        self.size = size
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    @classmethod
+    def forCapacity(cls, key_count, error_rate):
+        key_count = max(key_count, 1)
+        size = max(int(math.ceil(-key_count * math.log(error_rate) / math.log(2) ** 2)), 8)
+        hash_count = max(int(round(size / key_count * math.log(2))), 1)
+        return cls(size, hash_count)
+
+    # Builds a filter holding the given keys
+    @classmethod
+    def fromKeys(cls, keys, error_rate):
+        keys = list(keys)
+        bloom_filter = cls.forCapacity(len(keys), error_rate)
+        for key in keys:
+            bloom_filter.add(key)
+        return bloom_filter
+
+    def getPositions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + position * second) % self.size for position in range(self.hash_count))
+
+    def add(self, key):
+        for position in self.getPositions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def mightContain(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.getPositions(key))
+
+    def toDict(self):
+        return {'size': self.size, 'hashes': self.hash_count,
+                'bits': base64.b64encode(bytes(self.bits)).decode()}
+
+    @classmethod
+    def fromDict(cls, data):
+        return cls(data['size'], data['hashes'], bytearray(base64.b64decode(data['bits'])))
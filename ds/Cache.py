@@ -0,0 +1,68 @@
+from collections import OrderedDict
+import threading
+
+
+# Least recently used cache bounded by the approximate size in bytes of its
+# entries. Every entry carries a token (usually the mtime and size of the file
+# it was read from), a lookup with a different token is a miss.
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # {key: (value, size, token)}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, token=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[2] != token:
+                if entry is not None:
+                    self.remove(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size, token=None):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            if size > self.max_bytes:
+                return False
+
+            self.entries[key] = (value, size, token)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+    def invalidatePrefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                self.remove(key)
+
+    def remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def getStats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size': self.size,
+                'max_size': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
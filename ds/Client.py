@@ -0,0 +1,203 @@
+from .Protocol import OPERATIONS, encodeFrame, readFrame
+from .constants import CLIENT_POOL_SIZE
+import itertools
+import queue
+import socket
+import threading
+
+
+# Client of a DatabaseServer. It has the methods of Database, with the same
+# arguments and results, except scan filters which are given in their text
+# form (see Filters.parseFilter).
+#
+#   client = Client(('127.0.0.1', 7070))   # or Client('/tmp/dsbase.sock')
+#   status, row = client.get('students', 'S001')
+#
+# Up to 'pool_size' connections are kept open and shared by the threads using
+# the client. A pipeline sends many requests before reading their responses.
+class Client:
+    def __init__(self, address, pool_size=CLIENT_POOL_SIZE, timeout=None):
+        self.address = address
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self.ids = itertools.count(1)
+        self.ids_lock = threading.Lock()
+
+    def connect(self):
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        sock.connect(self.address)
+        return sock
+
+    def acquire(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    # Connections are only returned to the pool with no response pending
+    def release(self, sock):
+        try:
+            self.pool.put_nowait(sock)
+        except queue.Full:
+            sock.close()
+
+    def nextId(self):
+        with self.ids_lock:
+            return next(self.ids)
+
+    def call(self, op, *args, **kwargs):
+        return self.execute([(op, args, kwargs)])[0]
+
+    # Sends all the requests, then reads their responses in order
+    def execute(self, requests):
+        sock = self.acquire()
+        try:
+            frames = []
+            ids = []
+            for op, args, kwargs in requests:
+                request_id = self.nextId()
+                ids.append(request_id)
+                frames.append(encodeFrame({'id': request_id, 'op': op, 'args': list(args), 'kwargs': kwargs}))
+            sock.sendall(b''.join(frames))
+
+            results = []
+            for request_id, (op, _, _) in zip(ids, requests):
+                if op == 'scan':
+                    results.append(self.readScan(sock, request_id))
+                else:
+                    results.append(getResult(readResponse(sock, request_id)))
+        except BaseException:
+            sock.close()
+            raise
+        self.release(sock)
+        return results
+
+    # All the rows of a scan, for scans sent in a pipeline
+    def readScan(self, sock, request_id):
+        rows = []
+        while True:
+            response = readResponse(sock, request_id)
+            if 'rows' in response:
+                rows.extend(tuple(row) for row in response['rows'])
+                continue
+            status, payload = getResult(response)
+            return (True, rows) if status else (False, payload)
+
+    # Returns (True, iterator over the (row_id, row)) reading the rows as the
+    # server sends them. The connection is held until the iterator ends.
+    def scan(self, table_name, **kwargs):
+        sock = self.acquire()
+        request_id = self.nextId()
+        try:
+            sock.sendall(encodeFrame({'id': request_id, 'op': 'scan', 'args': [table_name], 'kwargs': kwargs}))
+            response = readResponse(sock, request_id)
+        except BaseException:
+            sock.close()
+            raise
+
+        if 'rows' not in response:
+            self.release(sock)
+            # A scan without rows has only its result frame
+            status, payload = getResult(response)
+            return (True, iter(())) if status else (False, payload)
+        return True, self.iterRows(sock, request_id, response)
+
+    def iterRows(self, sock, request_id, response):
+        finished = False
+        try:
+            while 'rows' in response:
+                for row in response['rows']:
+                    yield tuple(row)
+                response = readResponse(sock, request_id)
+            finished = True
+            status, payload = getResult(response)
+            if not status:
+                raise ConnectionError(payload)
+        finally:
+            # A scan left before its end leaves rows in the connection
+            if finished:
+                self.release(sock)
+            else:
+                sock.close()
+
+    def pipeline(self):
+        return Pipeline(self)
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __getattr__(self, name):
+        if name not in OPERATIONS:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+# Requests queued to be sent together by execute, which returns their results
+# in order. Scans return all their rows at once.
+#
+#   with client.pipeline() as pipeline:
+#       pipeline.put('students', 'S001', 'personal_info', 'name', 'Ana')
+#       pipeline.get('students', 'S001')
+#   results = pipeline.results
+class Pipeline:
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+        self.results = None
+
+    def execute(self):
+        requests, self.requests = self.requests, []
+        self.results = self.client.execute(requests) if requests else []
+        return self.results
+
+    def __getattr__(self, name):
+        if name not in OPERATIONS:
+            raise AttributeError(name)
+
+        def queueRequest(*args, **kwargs):
+            self.requests.append((name, args, kwargs))
+            return self
+        return queueRequest
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        return False
+
+
+def readResponse(sock, request_id):
+    response = readFrame(sock)
+    if response is None:
+        raise ConnectionError("Connection closed by the server")
+    if response.get('id') != request_id:
+        raise ConnectionError("Response out of order")
+    return response
+
+
+# Errors of the server are returned as (False, message)
+def getResult(response):
+    if 'error' in response:
+        return False, response['error']
+    return response['result']
@@ -0,0 +1,51 @@
+from .utils import checkFileExists
+import logging
+import threading
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Merges the segments of the families in a background thread, one family at
+# a time. The thread is started on demand and exits once the queue is empty.
+class CompactionScheduler:
+    def __init__(self):
+        self.queue = []
+        self.scheduled = set()
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def schedule(self, table, col_family):
+        key = (table.table_path, col_family)
+        with self.lock:
+            if key in self.scheduled:
+                return
+            self.scheduled.add(key)
+            self.queue.append((table, col_family))
+
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run)
+                self.worker.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.worker = None
+                    return
+                table, col_family = self.queue.pop(0)
+
+            # A failed job leaves the others to run, tables dropped since they
+            # were scheduled are skipped
+            try:
+                if checkFileExists(table.table_path):
+                    table.compact(col_family)
+            except Exception:
+                if checkFileExists(table.table_path):
+                    LOGGER.exception("Compaction of %s in %s failed", col_family, table.table_path)
+            finally:
+                with self.lock:
+                    self.scheduled.discard((table.table_path, col_family))
+
+
+COMPACTION_SCHEDULER = CompactionScheduler()
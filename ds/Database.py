@@ -1,21 +1,45 @@
-from .utils import checkDirectoryExists, loadJsonFile, createDirectory, createJsonFile, updateJsonFile, deleteJsonFile, removeDirectory, renameFile
-from .constants import METADATA_TEMPLATE, METADATA_SAVE_NAME, BASES_PATH
-from .Table import Table
+from .utils import checkDirectoryExists, loadJsonFile, createDirectory, createJsonFile, updateJsonFile, removeDirectory, getFileInode, getFileToken
+from .constants import METADATA_TEMPLATE, METADATA_SAVE_NAME, BASES_PATH, CACHE_MAX_BYTES, CACHE_TABLE_SIZE, STORAGE_FORMATS, DEFAULT_STORAGE_FORMAT, BLOOM_ERROR_RATE, IO_WORKERS, IO_POOL_KIND, FSYNC_POLICIES, FSYNC_POLICY, FSYNC_INTERVAL_MS, METADATA_LOCK_NAME
+from .Table import Table, getIndexFamily
+from .Batch import Batch
+from .Filters import FilterList, getTimeFilter
+from .Cache import LRUCache
+from .FamilyPool import FamilyPool
+from .FileLock import getFileLock
+import copy
+import time
 
 
 class Database:
-    def __init__(self, base_path):
+    def __init__(self, base_path, cache_bytes=CACHE_MAX_BYTES, io_workers=IO_WORKERS, io_pool=IO_POOL_KIND,
+                 fsync_policy=FSYNC_POLICY, fsync_interval=FSYNC_INTERVAL_MS):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy {fsync_policy}")
         self.base_name = base_path
         self.base_path = BASES_PATH + base_path + '/'
         self.metadata = {}
+        self.metadata_path = self.base_path + METADATA_SAVE_NAME
+        self.metadata_token = None
+        # Held by the commands changing the metadata, in any process
+        self.metadata_lock = getFileLock(self.base_path + METADATA_LOCK_NAME)
+        # Tables and segment indexes, kept between commands
+        self.cache = LRUCache(cache_bytes)
+        # Workers reading the families of the tables at the same time
+        self.pool = FamilyPool(io_workers, io_pool)
+        # When the writes reach the disk, see WriteAheadLog
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.sync_files = fsync_policy != 'never'
 
         if checkDirectoryExists(self.base_path):
             self.metadata = self.loadMetadata()
         elif createDirectory(self.base_path):
             self.createMetadata()
-            self.metadata = METADATA_TEMPLATE
+            self.metadata = copy.deepcopy(METADATA_TEMPLATE)
+        self.metadata_token = self.getMetadataToken()
 
     def table_exists(self, table_name):
+        self.refreshMetadata()
         return table_name in self.metadata['tables']
 
     def is_enabled(self, table_name):
@@ -23,6 +47,32 @@ class Database:
             return False
         return self.metadata['tables'][table_name]['is_enabled']
 
+    def getTable(self, table_name):
+        table_metadata = self.metadata['tables'][table_name]
+        column_families = table_metadata['column_families']
+        versions = table_metadata['max_versions']
+        # Tables created before the format was selectable are in JSON
+        storage_format = table_metadata.get('storage_format', DEFAULT_STORAGE_FORMAT)
+        indexes = table_metadata.get('indexes', [])
+        bloom_error_rate = table_metadata.get('bloom_error_rate', BLOOM_ERROR_RATE)
+        ttl = table_metadata.get('ttl', {})
+
+        # A change in the table definition invalidates the cached instance, and
+        # so does a table created again, whose segments reuse the same names
+        key = self.base_path + table_name + '/'
+        token = (tuple(column_families), versions, storage_format, tuple(indexes), bloom_error_rate,
+                 tuple(sorted(ttl.items())), table_metadata.get('created'))
+        table = self.cache.get(key, token)
+        if table is None:
+            table = Table(table_name, self.base_name, column_families,
+                          versions, self.cache, storage_format, indexes, bloom_error_rate, self.pool,
+                          self.fsync_policy, self.fsync_interval, ttl)
+            self.cache.put(key, table, CACHE_TABLE_SIZE, token)
+        return table
+
+    def get_cache_stats(self):
+        return self.cache.getStats()
+
     #############################
     ###     Decorators        ###
     #############################
@@ -41,23 +91,53 @@ class Database:
             return func(self, table_name, *args, **kwargs)
         return wrapper
 
+    # Commands changing the metadata run one at a time in all the processes
+    # using the base, on the metadata as last saved by any of them
+    def lock_metadata(func):
+        def wrapper(self, *args, **kwargs):
+            with self.metadata_lock:
+                self.refreshMetadata()
+                return func(self, *args, **kwargs)
+        return wrapper
+
     #############################
     ###      DDL Commands     ###
     #############################
 
-    def create_table(self, table_name, column_families, max_versions=1, is_enabled=True):
+    @lock_metadata
+    # 'ttl' is {col_family: seconds} for the families whose versions expire
+    def create_table(self, table_name, column_families, max_versions=1, is_enabled=True, storage_format=DEFAULT_STORAGE_FORMAT,
+                     bloom_error_rate=BLOOM_ERROR_RATE, ttl=None):
         if self.table_exists(table_name):
             return False, "Table already exists."
 
+        if storage_format not in STORAGE_FORMATS:
+            return False, "Invalid storage format."
+
+        if not 0 < bloom_error_rate < 1:
+            return False, "Bloom filter error rate must be between 0 and 1."
+
         # Check there are not repeated column families
         if len(column_families) != len(set(column_families)):
             return False, "Column families must be unique."
 
+        ttl = dict(ttl or {})
+        for column_family, seconds in ttl.items():
+            if column_family not in column_families:
+                return False, "Column family of the TTL does not exist."
+            if not isinstance(seconds, (int, float)) or seconds <= 0:
+                return False, "TTL must be a positive number of seconds."
+
         # First modify the metadata
         self.metadata['tables'][table_name] = {
             'column_families': column_families,
             'max_versions': max_versions,
-            'is_enabled': is_enabled
+            'is_enabled': is_enabled,
+            'storage_format': storage_format,
+            'bloom_error_rate': bloom_error_rate,
+            'ttl': ttl,
+            # Tells apart a table dropped and created again with the same definition
+            'created': time.time_ns()
         }
 
         # Then create the table in a json file
@@ -69,19 +149,22 @@ class Database:
         column_families_path = table_path_dir + '/'
 
         for column_family in column_families:
-            if not createJsonFile(column_families_path + column_family + '.json', {}):
+            if not createJsonFile(column_families_path + column_family + '.json', {}, self.sync_files):
                 return False, "Error creating column family directory."
 
         return self.updateMetadata(self.metadata), "Table and column families created successfully."
 
     def list_tables(self):
+        self.refreshMetadata()
         return list(self.metadata['tables'].keys())
 
+    @lock_metadata
     @check_table_exists
     def disable_table(self, table_name):
         self.metadata['tables'][table_name]['is_enabled'] = False
         return self.updateMetadata(self.metadata)
 
+    @lock_metadata
     @check_table_exists
     def enable_table(self, table_name):
         self.metadata['tables'][table_name]['is_enabled'] = True
@@ -91,9 +174,11 @@ class Database:
     def describe_table(self, table_name):
         return self.metadata['tables'][table_name]
 
+    @lock_metadata
     @check_table_exists
     def drop_table(self, table_name):
         del self.metadata['tables'][table_name]
+        self.cache.invalidatePrefix(self.base_path + table_name + '/')
 
         # Now remove the table file
         table_path = self.base_path + table_name
@@ -102,6 +187,7 @@ class Database:
 
         return self.updateMetadata(self.metadata), "Table dropped successfully."
 
+    @lock_metadata
     def drop_all_tables(self):
         success = True
         for table_name in self.list_tables():
@@ -112,25 +198,40 @@ class Database:
 
         return success, "All tables dropped successfully."
 
+    @lock_metadata
     @check_table_exists
     def alter_table(self, table_name, flag, value):
         versions = self.metadata['tables'][table_name]['max_versions']
         column_families = self.metadata['tables'][table_name]['column_families']
 
+        # Pending writes reference the families by name, persist them first
+        table = self.getTable(table_name)
+        if not table.flush():
+            return False, "Error flushing pending writes."
+
         # Convert the column_families array to a dictionary for easier manipulation
         column_families_dict = {cf: {} for cf in column_families}
 
-        if flag in ["DELETE", "ADD", "RENAME"]:
+        ttl = self.metadata['tables'][table_name].setdefault('ttl', {})
+
+        if flag in ["DELETE", "ADD", "RENAME", "TTL"]:
             if flag == "DELETE":
                 if not value in column_families_dict:
                     return False, "Column family does not exist."
 
-                status = deleteJsonFile(
-                    self.base_path + table_name + '/' + value + '.json')
+                status = table.dropFamily(value)
                 if not status:
                     return False, "Error deleting column family."
 
+                # The indexes of the family go with it
+                indexes = self.metadata['tables'][table_name].get('indexes', [])
+                for column in [column for column in indexes if column.partition(':')[0] == value]:
+                    if not table.dropFamily(getIndexFamily(column)):
+                        return False, "Error deleting index " + column + "."
+                    indexes.remove(column)
+
                 del column_families_dict[value]
+                ttl.pop(value, None)
             elif flag == "RENAME":
                 # Check it has the format old_col:new_col
                 if ':' not in value:
@@ -147,23 +248,57 @@ class Database:
                 if old_col == new_col:
                     return False, "No changes made. Column family names are the same."
 
-                if not renameFile(self.base_path + table_name + '/' + old_col + '.json', self.base_path + table_name + '/' + new_col + '.json'):
+                if not table.renameFamily(old_col, new_col):
                     return False, "Error renaming column family."
 
+                indexes = self.metadata['tables'][table_name].get('indexes', [])
+                for position, column in enumerate(indexes):
+                    col_family, _, col_name = column.partition(':')
+                    if col_family == old_col:
+                        new_column = new_col + ':' + col_name
+                        if not table.renameFamily(getIndexFamily(column), getIndexFamily(new_column)):
+                            return False, "Error renaming index " + column + "."
+                        indexes[position] = new_column
+
                 column_families_dict[new_col] = column_families_dict[old_col]
 
                 # Delete the old column family
                 del column_families_dict[old_col]
+                if old_col in ttl:
+                    ttl[new_col] = ttl.pop(old_col)
 
             elif flag == "ADD":
                 new_col = value
                 if new_col in column_families_dict:
                     return False, "Column family already exists."
 
-                if not createJsonFile(self.base_path + table_name + '/' + new_col + '.json', {}):
+                if not createJsonFile(self.base_path + table_name + '/' + new_col + '.json', {}, self.sync_files):
                     return False, "Error creating column family."
 
                 column_families_dict[new_col] = {}
+
+            elif flag == "TTL":
+                # Check it has the format col:seconds, 0 keeps the versions forever
+                col, _, seconds = value.partition(':')
+                if col not in column_families_dict:
+                    return False, "Column family does not exist."
+                try:
+                    seconds = float(seconds)
+                except ValueError:
+                    return False, "Invalid format. Use col:seconds."
+                if seconds < 0:
+                    return False, "TTL must be a positive number of seconds."
+
+                # The versions written before they were timestamps would all expire
+                if seconds and col not in ttl and not table.restampFamily(col):
+                    return False, "Error converting the versions of the column family."
+
+                if seconds:
+                    ttl[col] = int(seconds) if seconds.is_integer() else seconds
+                else:
+                    ttl.pop(col, None)
+                if not table.dropStats():
+                    return False, "Error resetting table stats."
         else:
             return False, "Invalid flag."
 
@@ -197,13 +332,30 @@ class Database:
         return metadata
 
     def createMetadata(self, metadata=METADATA_TEMPLATE):
-        if createJsonFile(self.base_path + METADATA_SAVE_NAME, metadata):
+        if createJsonFile(self.base_path + METADATA_SAVE_NAME, metadata, self.sync_files):
             return True
         return False
 
     def updateMetadata(self, metadata):
         self.metadata = metadata
-        return updateJsonFile(self.base_path + METADATA_SAVE_NAME, metadata)
+        if not updateJsonFile(self.metadata_path, metadata, self.sync_files):
+            return False
+        self.metadata_token = self.getMetadataToken()
+        return True
+
+    # Reloads the metadata when another process saved it since it was read
+    def refreshMetadata(self):
+        token = self.getMetadataToken()
+        if token == self.metadata_token:
+            return
+        metadata = loadJsonFile(self.metadata_path)
+        if metadata is not None:
+            self.metadata = metadata
+        self.metadata_token = token
+
+    # The file is replaced on every save, a new inode tells it changed
+    def getMetadataToken(self):
+        return getFileInode(self.metadata_path), getFileToken(self.metadata_path)
 
     #############################
     ###     DML Commands      ###
@@ -212,10 +364,7 @@ class Database:
     @check_table_exists
     @check_table_enabled
     def put(self, table_name, row_id, col_family, col_name, value):
-        versions = self.metadata['tables'][table_name]['max_versions']
-        column_families = self.metadata['tables'][table_name]['column_families']
-
-        table = Table(table_name, self.base_name, column_families, versions)
+        table = self.getTable(table_name)
         return table.put(row_id=row_id, col_family=col_family, col_name=col_name, value=value)
 
     def create_list_from_json(self, data):
@@ -229,73 +378,194 @@ class Database:
     @check_table_exists
     @check_table_enabled
     def put_many(self, table_name, file_path):
-        versions = self.metadata['tables'][table_name]['max_versions']
-        column_families = self.metadata['tables'][table_name]['column_families']
-
-        table = Table(table_name, self.base_name, column_families, versions)
+        table = self.getTable(table_name)
 
         # Read the file
         data = loadJsonFile(file_path)
-        if data is False:
+        if data is None:
             return False, "Error reading file."
 
         # Create a list of tuples from the json file
         data_list = self.create_list_from_json(data)
 
-        # Put the data in the table
-        for row_id, col_family, col_name, value in data_list:
-            status, message = table.put(
-                row_id=row_id, col_family=col_family, col_name=col_name, value=value)
-            if not status:
-                return False, message
+        # Put the data in the table, each column family is written once
+        start_time = time.time()
+        status, message = table.put_many(data_list)
+        if not status:
+            return False, message
+        elapsed_time = time.time() - start_time
 
-        return True, "Data inserted successfully."
+        cells_per_second = len(data_list) / elapsed_time if elapsed_time > 0 else len(data_list)
+        return True, f"{len(data_list)} cells inserted successfully ({cells_per_second:.0f} cells/sec)."
+
+    # Batch of mutations of a table, applied with its commit method
+    def batch(self, table_name):
+        return Batch(self, table_name)
 
     @check_table_exists
     @check_table_enabled
-    def get(self, table_name: str, row_id: str):
-        versions = self.metadata['tables'][table_name]['max_versions']
-        column_families = self.metadata['tables'][table_name]['column_families']
+    def mutate_rows(self, table_name, mutations):
+        table = self.getTable(table_name)
+        return table.mutate(mutations)
 
-        table = Table(table_name, self.base_name, column_families, versions)
-        return table.get(row_id)
+    @check_table_exists
+    @check_table_enabled
+    # 'time_range' is [start, end) and 'as_of' the last timestamp of the
+    # versions returned, in milliseconds since the epoch
+    def get(self, table_name: str, row_id: str, columns=None, versions=None, time_range=None, as_of=None):
+        try:
+            time_filter = getTimeFilter(time_range, as_of)
+        except (TypeError, ValueError) as error:
+            return False, str(error)
+        table = self.getTable(table_name)
+        return table.get(row_id, columns, versions, time_filter)
 
     @check_table_exists
     @check_table_enabled
-    def scan(self, table_name):
-        versions = self.metadata['tables'][table_name]['max_versions']
-        column_families = self.metadata['tables'][table_name]['column_families']
+    def multi_get(self, table_name, row_ids, columns=None):
+        table = self.getTable(table_name)
+        return table.multiGet(row_ids, columns)
+
+    # Rows whose latest version of an indexed 'cf:qualifier' is 'value'
+    @check_table_exists
+    @check_table_enabled
+    def query_index(self, table_name, column, value, columns=None, limit=None):
+        table = self.getTable(table_name)
+        return table.queryIndex(column, value, columns, limit)
 
-        table = Table(table_name, self.base_name, column_families, versions)
-        return table.scan()
+    @check_table_exists
+    @check_table_enabled
+    def scan(self, table_name, start_row=None, stop_row=None, prefix=None, limit=None, columns=None, filters=None,
+             time_range=None, as_of=None):
+        try:
+            time_filter = getTimeFilter(time_range, as_of)
+        except (TypeError, ValueError) as error:
+            return False, str(error)
+        table = self.getTable(table_name)
+        # The versions out of the time range are dropped before the other
+        # filters look at the cells
+        if time_filter is not None:
+            if filters is None:
+                filters = []
+            elif not isinstance(filters, (list, tuple)):
+                filters = [filters]
+            filters = [time_filter] + list(filters)
+        # A list of filters must all pass, an empty one leaves the rows unfiltered
+        if isinstance(filters, (list, tuple)):
+            filters = FilterList(filters) if filters else None
+        return table.scan(start_row=start_row, stop_row=stop_row, prefix=prefix, limit=limit, columns=columns,
+                          row_filter=filters)
 
     @check_table_exists
     @check_table_enabled
-    def delete(self, table_name, row_id, col_family, col_name, version):
-        versions = self.metadata['tables'][table_name]['max_versions']
-        column_families = self.metadata['tables'][table_name]['column_families']
+    def check_and_put(self, table_name, row_id, col_family, col_name, expected, value):
+        table = self.getTable(table_name)
+        return table.check_and_put(row_id, col_family, col_name, expected, value)
+
+    @check_table_exists
+    @check_table_enabled
+    def increment(self, table_name, row_id, col_family, col_name, delta=1):
+        table = self.getTable(table_name)
+        return table.increment(row_id, col_family, col_name, delta)
 
-        table = Table(table_name, self.base_name, column_families, versions)
+    @check_table_exists
+    @check_table_enabled
+    def delete(self, table_name, row_id, col_family, col_name, version):
+        table = self.getTable(table_name)
         return table.delete(row_id, col_family, col_name, version)
 
     @check_table_exists
     @check_table_enabled
     def delete_all(self, table_name, row_id: str):
-        versions = self.metadata['tables'][table_name]['max_versions']
-        column_families = self.metadata['tables'][table_name]['column_families']
-
-        table = Table(table_name, self.base_name, column_families, versions)
+        table = self.getTable(table_name)
         return table.delete_all(row_id)
 
     @check_table_exists
     @check_table_enabled
-    def count(self, table_name):
-        versions = self.metadata['tables'][table_name]['max_versions']
-        column_families = self.metadata['tables'][table_name]['column_families']
+    def count(self, table_name, exact=False):
+        table = self.getTable(table_name)
+        return table.count(exact)
+
+    @check_table_exists
+    @check_table_enabled
+    def get_table_stats(self, table_name, exact=False):
+        table = self.getTable(table_name)
+        stats = table.getStats(exact)
+        if stats is None:
+            return False, "Error saving table stats."
+        return True, stats
+
+    # Builds an index from the values of a 'cf:qualifier' to the row keys,
+    # kept up to date by the writes from then on
+    @lock_metadata
+    @check_table_exists
+    def create_index(self, table_name, column):
+        col_family, separator, col_name = column.partition(':')
+        if not separator or not col_name:
+            return False, "Invalid format. Use cf:qualifier."
+        if col_family not in self.metadata['tables'][table_name]['column_families']:
+            return False, "Column family does not exist."
+
+        indexes = self.metadata['tables'][table_name].setdefault('indexes', [])
+        if column in indexes:
+            return False, "Index already exists."
+
+        # Writes are indexed from now on, the rows before are indexed next
+        indexes.append(column)
+        if not self.updateMetadata(self.metadata):
+            return False, "Error updating metadata."
+        table = self.getTable(table_name)
+        if not table.buildIndex(column):
+            return False, "Error building index."
+        return True, "Index created successfully."
+
+    @lock_metadata
+    @check_table_exists
+    def drop_index(self, table_name, column):
+        indexes = self.metadata['tables'][table_name].get('indexes', [])
+        if column not in indexes:
+            return False, "Index does not exist."
+
+        table = self.getTable(table_name)
+        indexes.remove(column)
+        if not self.updateMetadata(self.metadata):
+            return False, "Error updating metadata."
+        if not table.dropFamily(getIndexFamily(column)):
+            return False, "Error deleting index."
+        return True, "Index dropped successfully."
 
-        table = Table(table_name, self.base_name, column_families, versions)
-        return table.count()
+    @check_table_exists
+    def flush(self, table_name):
+        table = self.getTable(table_name)
+        if not table.flush():
+            return False, "Error flushing table."
+        return True, "Table flushed successfully."
 
+    @lock_metadata
+    @check_table_exists
+    def migrate_table(self, table_name, storage_format):
+        if storage_format not in STORAGE_FORMATS:
+            return False, "Invalid storage format."
+
+        self.metadata['tables'][table_name]['storage_format'] = storage_format
+        if not self.updateMetadata(self.metadata):
+            return False, "Error updating metadata."
+
+        # Compacting rewrites every family in the format of the table
+        return self.compact(table_name)
+
+    @check_table_exists
+    def compact(self, table_name):
+        table = self.getTable(table_name)
+        if not table.flush():
+            return False, "Error flushing table."
+
+        for column_family in table.column_families + [getIndexFamily(column) for column in table.indexes]:
+            if not table.compact(column_family):
+                return False, "Error compacting column family " + column_family + "."
+        return True, "Table compacted successfully."
+
+    @lock_metadata
     @check_table_exists
     def truncate(self, table_name):
         table_metadata = self.metadata['tables'][table_name]
@@ -313,5 +583,15 @@ class Database:
         column_families = table_metadata['column_families']
         versions = table_metadata['max_versions']
         is_enabled = True
-
-        return self.create_table(table_name, column_families, versions, is_enabled)
+        storage_format = table_metadata.get('storage_format', DEFAULT_STORAGE_FORMAT)
+        indexes = table_metadata.get('indexes', [])
+        bloom_error_rate = table_metadata.get('bloom_error_rate', BLOOM_ERROR_RATE)
+        ttl = table_metadata.get('ttl', {})
+
+        status, message = self.create_table(table_name, column_families, versions, is_enabled, storage_format,
+                                            bloom_error_rate, ttl)
+        # The indexes of an empty table are empty
+        if status and indexes:
+            self.metadata['tables'][table_name]['indexes'] = indexes
+            status = self.updateMetadata(self.metadata)
+        return status, message
@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import queue
+import threading
+
+
+# Runs the per family work of a table (lookups, decoding, scans) at the same
+# time. The results are always returned in the order of the families given,
+# so they are merged the same way as when read one after the other.
+#
+# Lookups and scans run in threads, the file reads release the GIL. The full
+# decode of families, which is bound by the CPU, runs in processes when
+# 'kind' is 'process'. With a single worker everything runs in the caller.
+class FamilyPool:
+    def __init__(self, workers=1, kind='thread'):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Invalid pool kind {kind}")
+        self.workers = workers
+        self.kind = kind
+        self.threads = None
+        self.processes = None
+        self.lock = threading.Lock()
+
+    def getThreads(self):
+        with self.lock:
+            if self.threads is None:
+                self.threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='FamilyPool')
+            return self.threads
+
+    def getProcesses(self):
+        with self.lock:
+            if self.processes is None:
+                self.processes = ProcessPoolExecutor(max_workers=self.workers)
+            return self.processes
+
+    # [function(item) for item in items], in threads
+    def map(self, function, items):
+        items = list(items)
+        if self.workers <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        return list(self.getThreads().map(function, items))
+
+    # Same as map, in processes for a pool of kind 'process'. The function
+    # and the items must be picklable.
+    def mapDecode(self, function, items):
+        items = list(items)
+        if self.kind != 'process' or self.workers <= 1 or len(items) <= 1:
+            return self.map(function, items)
+        return list(self.getProcesses().map(function, items))
+
+    # Reads the rows ahead in a thread, 'batch_size' at a time, while the
+    # caller consumes them. The thread stops when the iterator is closed.
+    def prefetch(self, rows, batch_size):
+        if self.workers <= 1:
+            return rows
+        return prefetchRows(rows, batch_size)
+
+    def shutdown(self):
+        with self.lock:
+            for executor in (self.threads, self.processes):
+                if executor is not None:
+                    executor.shutdown()
+            self.threads = None
+            self.processes = None
+
+
+PREFETCH_DONE = object()
+
+
+def prefetchRows(rows, batch_size):
+    batches = queue.Queue(maxsize=2)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    if not putBatch(batches, batch, stop):
+                        return
+                    batch = []
+            if batch and not putBatch(batches, batch, stop):
+                return
+            putBatch(batches, PREFETCH_DONE, stop)
+        except Exception as error:
+            putBatch(batches, error, stop)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is PREFETCH_DONE:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+    finally:
+        stop.set()
+
+
+# Waits for room in the queue unless the consumer is gone
+def putBatch(batches, batch, stop):
+    while not stop.is_set():
+        try:
+            batches.put(batch, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
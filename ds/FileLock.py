@@ -0,0 +1,68 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks, the lock only excludes the threads of the process
+    fcntl = None
+
+
+# Exclusive lock shared by the threads of a process and by the processes
+# using the same base, through an flock on 'lock_path'. It is reentrant, the
+# file is locked by the outermost acquire and unlocked by its release.
+#
+# Locks are shared by all the instances pointing to the same path, see
+# getFileLock, two descriptors of the same file would exclude each other.
+class FileLock:
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.descriptor = None
+
+    def acquire(self):
+        self.lock.acquire()
+        try:
+            if self.depth == 0 and fcntl is not None:
+                # Opened every time, the file is gone with its table when dropped
+                descriptor = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(descriptor, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(descriptor)
+                    raise
+                self.descriptor = descriptor
+            self.depth += 1
+        except BaseException:
+            self.lock.release()
+            raise
+        return True
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0 and self.descriptor is not None:
+            descriptor, self.descriptor = self.descriptor, None
+            try:
+                fcntl.flock(descriptor, fcntl.LOCK_UN)
+            finally:
+                os.close(descriptor)
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+FILE_LOCKS = {}
+FILE_LOCKS_GUARD = threading.Lock()
+
+
+def getFileLock(lock_path):
+    with FILE_LOCKS_GUARD:
+        if lock_path not in FILE_LOCKS:
+            FILE_LOCKS[lock_path] = FileLock(lock_path)
+        return FILE_LOCKS[lock_path]
@@ -0,0 +1,220 @@
+from .Versions import latestVersion
+import operator
+import re
+
+
+# Scan filters, modeled on the ones of HBase. They are evaluated while the
+# rows are read:
+#
+#   filterRowKey(row_id)          False drops the row before its records are
+#                                 decoded, in the segments and the memtable
+#   filterCells(cf, row_data)     the cells of a family that are kept
+#   filterRow(row)                False drops the row, {cf: row_data} once
+#                                 the cells of all its families are filtered
+#
+# A filter only overrides the steps it takes part in.
+class Filter:
+    def filterRowKey(self, row_id):
+        return True
+
+    def filterCells(self, col_family, row_data):
+        return row_data
+
+    def filterRow(self, row):
+        return True
+
+
+COMPARE_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '~': lambda value, pattern: re.search(pattern, value) is not None,
+}
+
+
+def compareValues(value, compare_op, other):
+    if compare_op not in COMPARE_OPERATORS:
+        raise ValueError(f"Invalid compare operator {compare_op}")
+    return COMPARE_OPERATORS[compare_op](str(value), other)
+
+
+class RowPrefixFilter(Filter):
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def filterRowKey(self, row_id):
+        return row_id.startswith(self.prefix)
+
+
+class RowRegexFilter(Filter):
+    def __init__(self, pattern):
+        self.pattern = re.compile(pattern)
+
+    def filterRowKey(self, row_id):
+        return self.pattern.search(row_id) is not None
+
+
+# Keeps the qualifiers whose name compares to 'col_name'
+class QualifierFilter(Filter):
+    def __init__(self, compare_op, col_name):
+        compareValues('', compare_op, col_name)
+        self.compare_op = compare_op
+        self.col_name = col_name
+
+    def filterCells(self, col_family, row_data):
+        return {col_name: value_versions for col_name, value_versions in row_data.items()
+                if compareValues(col_name, self.compare_op, self.col_name)}
+
+
+# Keeps the versions in [min_version, max_version], either bound can be None
+class VersionRangeFilter(Filter):
+    def __init__(self, min_version=None, max_version=None):
+        self.min_version = None if min_version is None else int(min_version)
+        self.max_version = None if max_version is None else int(max_version)
+
+    def filterCells(self, col_family, row_data):
+        filtered = {}
+        for col_name, value_versions in row_data.items():
+            value_versions = {version: value for version, value in value_versions.items()
+                              if self.isInRange(int(version))}
+            if value_versions:
+                filtered[col_name] = value_versions
+        return filtered
+
+    def isInRange(self, version):
+        return ((self.min_version is None or version >= self.min_version) and
+                (self.max_version is None or version <= self.max_version))
+
+
+# Keeps the cells whose latest version compares to 'value'
+class ValueFilter(Filter):
+    def __init__(self, compare_op, value):
+        compareValues('', compare_op, value)
+        self.compare_op = compare_op
+        self.value = value
+
+    def filterCells(self, col_family, row_data):
+        return {col_name: value_versions for col_name, value_versions in row_data.items()
+                if value_versions and compareValues(latestValue(value_versions), self.compare_op, self.value)}
+
+
+# Keeps the rows whose latest version of 'cf:qualifier' compares to 'value',
+# the rows without the column are dropped unless 'filter_if_missing' is False
+class SingleColumnValueFilter(Filter):
+    def __init__(self, col_family, col_name, compare_op, value, filter_if_missing=True):
+        compareValues('', compare_op, value)
+        self.col_family = col_family
+        self.col_name = col_name
+        self.compare_op = compare_op
+        self.value = value
+        self.filter_if_missing = filter_if_missing
+
+    def filterRow(self, row):
+        value_versions = row.get(self.col_family, {}).get(self.col_name)
+        if not value_versions:
+            return not self.filter_if_missing
+        return compareValues(latestValue(value_versions), self.compare_op, self.value)
+
+
+# Combines filters, a row must pass all of them, or any of them when
+# 'require_all' is False
+class FilterList(Filter):
+    def __init__(self, filters, require_all=True):
+        self.filters = list(filters)
+        self.require_all = require_all
+
+    def filterRowKey(self, row_id):
+        results = (row_filter.filterRowKey(row_id) for row_filter in self.filters)
+        return all(results) if self.require_all else any(results)
+
+    def filterCells(self, col_family, row_data):
+        if not self.require_all:
+            # A cell is kept when any of the filters keeps it
+            kept = {}
+            for row_filter in self.filters:
+                for col_name, value_versions in row_filter.filterCells(col_family, row_data).items():
+                    kept.setdefault(col_name, {}).update(value_versions)
+            return kept
+
+        for row_filter in self.filters:
+            row_data = row_filter.filterCells(col_family, row_data)
+            if not row_data:
+                break
+        return row_data
+
+    def filterRow(self, row):
+        results = (row_filter.filterRow(row) for row_filter in self.filters)
+        return all(results) if self.require_all else any(results)
+
+
+def latestValue(value_versions):
+    return value_versions[latestVersion(value_versions)]
+
+
+# Versions are write timestamps in milliseconds: keeps the ones written in
+# [start, end) of 'time_range' and not after 'as_of'. None without either.
+def getTimeFilter(time_range=None, as_of=None):
+    if time_range is None and as_of is None:
+        return None
+
+    min_version = max_version = None
+    if time_range is not None:
+        if len(time_range) != 2:
+            raise ValueError("Time range should be a start and an end timestamp")
+        start, end = time_range
+        min_version = None if start is None else int(start)
+        max_version = None if end is None else int(end) - 1
+    if as_of is not None:
+        as_of = int(as_of)
+        max_version = as_of if max_version is None else min(max_version, as_of)
+    return VersionRangeFilter(min_version, max_version)
+
+
+FILTER_PATTERN = re.compile(r'^([^=!<>~]+)(==|!=|<=|>=|<|>|~)(.*)$')
+
+
+# Filter from its text form, used by the command line:
+#
+#   row~<regex>                  RowRegexFilter
+#   qualifier<op><name>          QualifierFilter
+#   value<op><value>             ValueFilter
+#   version>=<n>, version<=<n>   VersionRangeFilter
+#   <cf>:<qualifier><op><value>  SingleColumnValueFilter
+#
+# with <op> one of ==, !=, <, <=, >, >= or ~ for a regular expression.
+# Raises ValueError when the text is not a valid filter.
+def parseFilter(text):
+    try:
+        return buildFilter(text)
+    except re.error as error:
+        raise ValueError(f"Invalid regular expression in filter {text}: {error}")
+
+
+def buildFilter(text):
+    match = FILTER_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"Invalid filter {text}")
+    target, compare_op, value = match.groups()
+
+    if target == 'row':
+        if compare_op != '~':
+            raise ValueError("Row filters only support ~")
+        return RowRegexFilter(value)
+    if target == 'qualifier':
+        return QualifierFilter(compare_op, value)
+    if target == 'value':
+        return ValueFilter(compare_op, value)
+    if target == 'version':
+        if compare_op == '>=':
+            return VersionRangeFilter(min_version=value)
+        if compare_op == '<=':
+            return VersionRangeFilter(max_version=value)
+        raise ValueError("Version filters only support >= and <=")
+
+    col_family, separator, col_name = target.partition(':')
+    if not separator or not col_family or not col_name:
+        raise ValueError(f"Invalid filter {text}")
+    return SingleColumnValueFilter(col_family, col_name, compare_op, value)
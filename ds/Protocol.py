@@ -0,0 +1,86 @@
+import json
+import struct
+
+
+# Frames exchanged by the Server and the Client: a 4 byte big endian length
+# followed by that many bytes of compact JSON.
+#
+#   request   {"id": n, "op": "<Database method>", "args": [...], "kwargs": {...}}
+#   response  {"id": n, "result": <value returned by the method>}
+#             {"id": n, "error": "<message>"}
+#   scan      {"id": n, "rows": [[row_id, row], ...]} for every batch of rows,
+#             then {"id": n, "result": [true, null]}
+#
+# The responses of a connection come in the order of its requests, so a
+# client can send several requests before reading any response.
+
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+# Methods of Database callable through the server
+OPERATIONS = {
+    'table_exists', 'is_enabled', 'get_cache_stats', 'get_status', 'get_version', 'get_whoami',
+    'create_table', 'list_tables', 'disable_table', 'enable_table', 'describe_table', 'drop_table',
+    'drop_all_tables', 'alter_table', 'truncate', 'create_index', 'drop_index', 'migrate_table',
+    'put', 'put_many', 'mutate_rows', 'check_and_put', 'increment', 'get', 'multi_get', 'query_index', 'scan',
+    'delete', 'delete_all', 'count', 'get_table_stats', 'flush', 'compact',
+}
+
+# Operations changing the metadata of the database, run one at a time
+DDL_OPERATIONS = {
+    'create_table', 'disable_table', 'enable_table', 'drop_table', 'drop_all_tables', 'alter_table',
+    'truncate', 'create_index', 'drop_index', 'migrate_table',
+}
+
+
+def encodeFrame(message):
+    payload = json.dumps(packValue(message), separators=(',', ':')).encode()
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+# Reads a frame from a socket, None when the connection is closed
+def readFrame(sock):
+    header = readExactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ConnectionError(f"Frame of {length} bytes is too large")
+    payload = readExactly(sock, length)
+    if payload is None:
+        raise ConnectionError("Connection closed in the middle of a frame")
+    return unpackValue(json.loads(payload))
+
+
+def readExactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            if data:
+                raise ConnectionError("Connection closed in the middle of a frame")
+            return None
+        data += chunk
+    return bytes(data)
+
+
+# JSON has no tuples, they are sent as {"__tuple__": [...]} so the (status,
+# payload) results keep their type
+def packValue(value):
+    if isinstance(value, tuple):
+        return {'__tuple__': [packValue(item) for item in value]}
+    if isinstance(value, list):
+        return [packValue(item) for item in value]
+    if isinstance(value, dict):
+        return {key: packValue(item) for key, item in value.items()}
+    return value
+
+
+def unpackValue(value):
+    if isinstance(value, dict):
+        if len(value) == 1 and '__tuple__' in value:
+            return tuple(unpackValue(item) for item in value['__tuple__'])
+        return {key: unpackValue(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [unpackValue(item) for item in value]
+    return value
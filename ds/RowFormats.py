@@ -0,0 +1,183 @@
+from .constants import DATA_FILE_EXTENSION, BINARY_FILE_EXTENSION
+import json
+
+JSON_DECODER = json.JSONDecoder()
+
+# Layouts of the records of a segment file. Each record holds one row, the
+# segments read the raw records of their rows and decode them on demand.
+
+class JsonRowFormat:
+    # A JSON object with one row per line, so it can be read with json.load
+    # while staying easy to split row by row
+    extension = DATA_FILE_EXTENSION
+    header = b"{\n"
+    footer = b"}\n"
+    empty_body = b"\n"
+
+    def encode(self, row_id, row_data):
+        return (json.dumps(row_id) + ": " + json.dumps(row_data) + "\n").encode()
+
+    # Every record but the last one ends with a comma
+    def join(self, record):
+        return record[:-1] + b",\n"
+
+    # Raw bytes of the next record, blank lines are returned as they are
+    def readRecord(self, file):
+        line = file.readline()
+        if not line or line == self.footer:
+            return None
+        return line
+
+    # Row key of a record without decoding the row
+    def decodeKey(self, record):
+        return JSON_DECODER.raw_decode(record.decode())[0]
+
+    # Only the given qualifiers of the row are returned, all of them when None
+    def decode(self, record, qualifiers=None):
+        row = json.loads(b"{" + record.rstrip(b",\n") + b"}")
+        row_id, row_data = next(iter(row.items()))
+        if qualifiers is not None and isinstance(row_data, dict):
+            row_data = {col_name: value for col_name, value in row_data.items() if col_name in qualifiers}
+        return row_id, row_data
+
+
+class BinaryRowFormat:
+    # Length prefixed records: the row key, then the row encoded as the
+    # number of qualifiers followed by every qualifier with its versions.
+    # Lengths and counts are varints, one byte for anything below 128.
+    extension = BINARY_FILE_EXTENSION
+    header = b"DSB\x01"
+    footer = b""
+    empty_body = b""
+
+    def encode(self, row_id, row_data):
+        payload = encodeBinaryRow(row_data)
+        return packBytes(row_id.encode()) + packBytes(payload)
+
+    def join(self, record):
+        return record
+
+    def readRecord(self, file):
+        key_header = readVarint(file)
+        if key_header is None:
+            return None
+        key = file.read(decodeVarint(key_header, 0)[0])
+        payload_header = readVarint(file)
+        payload = file.read(decodeVarint(payload_header, 0)[0])
+        return key_header + key + payload_header + payload
+
+    def decodeKey(self, record):
+        return unpackBytes(record, 0)[0].decode()
+
+    def decode(self, record, qualifiers=None):
+        row_id, offset = unpackBytes(record, 0)
+        payload, _ = unpackBytes(record, offset)
+        return row_id.decode(), decodeBinaryRow(payload, qualifiers)
+
+
+ROW_FORMATS = {
+    'json': JsonRowFormat(),
+    'binary': BinaryRowFormat(),
+}
+
+
+def getRowFormat(file_path):
+    for row_format in ROW_FORMATS.values():
+        if file_path.endswith(row_format.extension):
+            return row_format
+    return None
+
+
+def encodeVarint(number):
+    encoded = bytearray()
+    while number >= 0x80:
+        encoded.append((number & 0x7F) | 0x80)
+        number >>= 7
+    encoded.append(number)
+    return bytes(encoded)
+
+
+def decodeVarint(data, offset):
+    number = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+# Raw bytes of the varint at the position of the file, None at the end
+def readVarint(file):
+    encoded = bytearray()
+    while True:
+        byte = file.read(1)
+        if not byte:
+            return None
+        encoded += byte
+        if byte[0] < 0x80:
+            return bytes(encoded)
+
+
+def packBytes(data):
+    return encodeVarint(len(data)) + data
+
+
+def unpackBytes(data, offset):
+    length, offset = decodeVarint(data, offset)
+    return data[offset:offset + length], offset + length
+
+
+def encodeBinaryRow(row_data):
+    if row_data is None:
+        return b"n"
+
+    # Rows that are not {qualifier: {version: value}} are kept as JSON
+    if not isinstance(row_data, dict) or not all(isinstance(versions, dict) for versions in row_data.values()):
+        return b"j" + json.dumps(row_data).encode()
+
+    parts = [b"r", encodeVarint(len(row_data))]
+    for col_name, value_versions in row_data.items():
+        parts.append(packBytes(col_name.encode()))
+        parts.append(encodeVarint(len(value_versions)))
+        for version, value in value_versions.items():
+            parts.append(packBytes(version.encode()))
+            # put stores strings, values loaded from other files may not be
+            if isinstance(value, str):
+                parts.append(b"s" + packBytes(value.encode()))
+            else:
+                parts.append(b"j" + packBytes(json.dumps(value).encode()))
+    return b"".join(parts)
+
+
+# The values of the qualifiers not among the given ones are skipped without
+# decoding them
+def decodeBinaryRow(payload, qualifiers=None):
+    tag = payload[:1]
+    if tag == b"n":
+        return None
+    if tag == b"j":
+        row_data = json.loads(payload[1:])
+        if qualifiers is not None and isinstance(row_data, dict):
+            row_data = {col_name: value for col_name, value in row_data.items() if col_name in qualifiers}
+        return row_data
+
+    row_data = {}
+    col_count, offset = decodeVarint(payload, 1)
+    for _ in range(col_count):
+        col_name, offset = unpackBytes(payload, offset)
+        col_name = col_name.decode()
+        version_count, offset = decodeVarint(payload, offset)
+        skip = qualifiers is not None and col_name not in qualifiers
+        value_versions = {}
+        for _ in range(version_count):
+            version, offset = unpackBytes(payload, offset)
+            value_tag = payload[offset:offset + 1]
+            value, offset = unpackBytes(payload, offset + 1)
+            if not skip:
+                value_versions[version.decode()] = value.decode() if value_tag == b"s" else json.loads(value)
+        if not skip:
+            row_data[col_name] = value_versions
+    return row_data
@@ -0,0 +1,306 @@
+from .utils import loadJsonFile, replaceJsonFile, replaceFile, syncFile, checkFileExists, deleteJsonFile, renameFile, getFileToken, iterJsonObject, getTempPath
+from .constants import INDEX_FILE_EXTENSION, CACHE_MAX_BYTES, SCAN_BATCH_SIZE, SEGMENT_BLOCK_SIZE, BLOOM_ERROR_RATE
+from .Cache import LRUCache
+from .RowFormats import JsonRowFormat, getRowFormat
+from .BloomFilter import BloomFilter
+from .Versions import sortVersions
+import bisect
+import io
+import mmap
+
+
+# Immutable file holding the rows of a column family sorted by row key. A row
+# set to None is a tombstone hiding the same row in the older segments.
+#
+# The rows are stored one record each, in the format given by the extension
+# of the file (see RowFormats). They are grouped in blocks of
+# SEGMENT_BLOCK_SIZE rows and a sparse index next to the file holds the first
+# key and the offset of every block:
+#
+#   {"keys": [first row key of every block], "offsets": [offset of every
+#    block], "end": offset after the last record, "rows": number of rows,
+#    "bloom": Bloom filter of the row keys}
+#
+# A row, or the start of a range, is found with a binary search over the
+# blocks and a read of the records of a single block. Lookups of rows the
+# Bloom filter rules out do not read the file at all.
+#
+# The index is kept in the cache shared by the tables of a database,
+# validated against the mtime and size of its file.
+# Rows are read through a memory map of the file, so only the bytes of the
+# rows decoded are copied and every process reading the segment shares the
+# same pages of the OS cache.
+class Segment:
+    # 'stats' counts the lookups checked against the Bloom filter, the ones
+    # it skipped and its false positives
+    def __init__(self, segment_path, cache=None, bloom_error_rate=BLOOM_ERROR_RATE, stats=None):
+        self.segment_path = segment_path
+        self.row_format = getRowFormat(segment_path)
+        self.index_path = segment_path[:-len(self.row_format.extension)] + INDEX_FILE_EXTENSION
+        self.cache = cache if cache is not None else LRUCache(CACHE_MAX_BYTES)
+        self.bloom_error_rate = bloom_error_rate
+        self.stats = stats if stats is not None else newBloomStats()
+        self.map = None
+        self.map_token = None
+
+    # Memory map shared by the point lookups, which do not move its position.
+    # A file written since then under the same name gets a new map, a deleted
+    # one is still read through the old map.
+    def getMap(self):
+        token = getFileToken(self.segment_path)
+        if self.map is not None and token is not None and token != self.map_token:
+            self.closeMap()
+        if self.map is None:
+            self.map = openMap(self.segment_path)
+            self.map_token = token
+        return self.map
+
+    def closeMap(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def loadIndex(self):
+        index = self.loadCached(self.index_path, loadIndexFile)
+        if index is None:
+            index = self.buildIndex()
+        return index
+
+    def loadCached(self, file_path, load):
+        token = getFileToken(file_path)
+        if token is None:
+            return None
+
+        data = self.cache.get(file_path, token)
+        if data is None:
+            data = load(file_path)
+            if data is not None:
+                self.cache.put(file_path, data, token[1], token)
+        return data
+
+    # Returns (found, row_data), row_data is None for a tombstone. Only the
+    # given qualifiers are decoded, all of them when None.
+    def getRow(self, row_id, qualifiers=None):
+        index = self.loadIndex()
+        if index is None:
+            return False, None
+
+        self.stats['checks'] += 1
+        if not index['bloom'].mightContain(row_id):
+            self.stats['skips'] += 1
+            return False, None
+
+        found, row_data = self.findRow(index, row_id, qualifiers)
+        if not found:
+            self.stats['false_positives'] += 1
+        return found, row_data
+
+    def findRow(self, index, row_id, qualifiers):
+        block = bisect.bisect_right(index['keys'], row_id) - 1
+        if block < 0:
+            return False, None
+
+        # Only the keys of the records before the row are decoded
+        start, end = getBlockRange(index, block)
+        block_file = io.BytesIO(self.getMap()[start:end])
+        for record in iter(lambda: self.row_format.readRecord(block_file), None):
+            if not record.strip():
+                continue
+            key = self.row_format.decodeKey(record)
+            if key == row_id:
+                return True, self.row_format.decode(record, qualifiers)[1]
+            if key > row_id:
+                break
+        return False, None
+
+    # Opens the segment right away, so the rows can still be read if it is
+    # compacted away, and returns an iterator over the (row_id, row_data) in
+    # [start_row, stop_row), reading SCAN_BATCH_SIZE records at a time. The
+    # records whose key 'row_filter' drops are skipped without decoding them.
+    def iterRows(self, start_row=None, stop_row=None, qualifiers=None, row_filter=None):
+        index = self.loadIndex()
+        if not index or not index['rows']:
+            return iter(())
+
+        offset = len(self.row_format.header)
+        if start_row is not None:
+            # The block holding the first row at or after start_row
+            block = max(bisect.bisect_right(index['keys'], start_row) - 1, 0)
+            offset = index['offsets'][block]
+
+        # Every scan gets its own map, they move its position as they read
+        return self.readRows(openMap(self.segment_path), offset, stop_row, qualifiers, row_filter, start_row)
+
+    def readRows(self, file, offset, stop_row, qualifiers=None, row_filter=None, start_row=None):
+        with file:
+            file.seek(offset)
+            while True:
+                records = []
+                while len(records) < SCAN_BATCH_SIZE:
+                    record = self.row_format.readRecord(file)
+                    if record is None:
+                        break
+                    records.append(record)
+
+                for record in records:
+                    if not record.strip():
+                        continue
+                    if row_filter is not None or start_row is not None:
+                        row_id = self.row_format.decodeKey(record)
+                        # The rows of the first block before the range
+                        if start_row is not None and row_id < start_row:
+                            continue
+                        start_row = None
+                        if stop_row is not None and row_id >= stop_row:
+                            return
+                        if row_filter is not None and not row_filter.filterRowKey(row_id):
+                            continue
+                    row_id, row_data = self.row_format.decode(record, qualifiers)
+                    if stop_row is not None and row_id >= stop_row:
+                        return
+                    yield row_id, row_data
+
+                if len(records) < SCAN_BATCH_SIZE:
+                    return
+
+    # JSON segments written before the index existed, or by hand, may be
+    # indented or unsorted; those are rewritten in the row per line layout
+    def buildIndex(self):
+        if not checkFileExists(self.segment_path):
+            return None
+
+        index = self.indexRows()
+        if index is None:
+            if not isinstance(self.row_format, JsonRowFormat):
+                return None
+            # Read with the streaming parser, only the rows are kept to sort them
+            rows = ((row_id, sortVersions(row_data)) for row_id, row_data in iterJsonObject(self.segment_path))
+            if not Segment.write(self.segment_path, rows, bloom_error_rate=self.bloom_error_rate):
+                return None
+            self.closeMap()
+            return loadIndexFile(self.index_path)
+
+        replaceJsonFile(self.index_path, index, indent=None)
+        return loadIndexFile(self.index_path)
+
+    # Index of the records of a segment, None if they are not sorted records
+    # of its format
+    def indexRows(self):
+        index = newIndex()
+        row_ids = []
+        last_row_id = None
+        with open(self.segment_path, "rb") as file:
+            header = self.row_format.header
+            if file.read(len(header)) != header:
+                return None
+            offset = len(header)
+            for record in iter(lambda: self.row_format.readRecord(file), None):
+                if record.strip():
+                    try:
+                        row_id, _ = self.row_format.decode(record)
+                    except ValueError:
+                        return None
+                    if last_row_id is not None and row_id <= last_row_id:
+                        return None
+                    addToIndex(index, row_id, offset)
+                    row_ids.append(row_id)
+                    last_row_id = row_id
+                offset += len(record)
+                index['end'] = offset
+        index['bloom'] = BloomFilter.fromKeys(row_ids, self.bloom_error_rate).toDict()
+        return index
+
+    def rename(self, new_segment_path):
+        self.closeMap()
+        self.cache.invalidate(self.index_path)
+        if not renameFile(self.segment_path, new_segment_path):
+            return False
+        if checkFileExists(self.index_path):
+            renameFile(self.index_path, Segment(new_segment_path).index_path)
+        return True
+
+    def delete(self):
+        self.closeMap()
+        self.cache.invalidate(self.index_path)
+        deleteJsonFile(self.index_path)
+        return deleteJsonFile(self.segment_path)
+
+    # Writes the rows sorted by key along with their index. Rows already in
+    # key order are written as they come, only their keys are kept in memory
+    # for the Bloom filter. With 'sync' the segment is on disk when it returns.
+    @staticmethod
+    def write(segment_path, rows, is_sorted=False, bloom_error_rate=BLOOM_ERROR_RATE, sync=True):
+        if not is_sorted:
+            rows = sorted(rows, key=lambda row: row[0])
+
+        row_format = getRowFormat(segment_path)
+        index = newIndex()
+        row_ids = []
+        temp_path = getTempPath(segment_path)
+        with open(temp_path, "wb") as file:
+            file.write(row_format.header)
+            offset = len(row_format.header)
+            previous = None
+            for row_id, row_data in rows:
+                if previous is not None:
+                    record = row_format.join(previous[1])
+                    addToIndex(index, previous[0], offset)
+                    file.write(record)
+                    offset += len(record)
+                previous = (row_id, row_format.encode(row_id, row_data))
+                row_ids.append(row_id)
+
+            if previous is None:
+                file.write(row_format.empty_body)
+                offset += len(row_format.empty_body)
+            else:
+                addToIndex(index, previous[0], offset)
+                file.write(previous[1])
+                offset += len(previous[1])
+            index['end'] = offset
+            file.write(row_format.footer)
+            if sync:
+                syncFile(file)
+        index['bloom'] = BloomFilter.fromKeys(row_ids, bloom_error_rate).toDict()
+
+        segment = Segment(segment_path)
+        replaceJsonFile(segment.index_path, index, indent=None, sync=sync)
+        return replaceFile(temp_path, segment_path, sync)
+
+
+def newIndex():
+    return {'keys': [], 'offsets': [], 'end': 0, 'rows': 0}
+
+
+# Adds the record of a row, which starts a new block every SEGMENT_BLOCK_SIZE rows
+def addToIndex(index, row_id, offset):
+    if index['rows'] % SEGMENT_BLOCK_SIZE == 0:
+        index['keys'].append(row_id)
+        index['offsets'].append(offset)
+    index['rows'] += 1
+
+
+def newBloomStats():
+    return {'checks': 0, 'skips': 0, 'false_positives': 0}
+
+
+# Index files written before the sparse index held every row key, and the
+# ones without a Bloom filter, are built again
+def loadIndexFile(file_path):
+    index = loadJsonFile(file_path)
+    if index is None or not isinstance(index.get('rows'), int) or 'bloom' not in index:
+        return None
+    index['bloom'] = BloomFilter.fromDict(index['bloom'])
+    return index
+
+
+def getBlockRange(index, block):
+    offsets = index['offsets']
+    end = offsets[block + 1] if block + 1 < len(offsets) else index['end']
+    return offsets[block], end
+
+
+def openMap(file_path):
+    # The map stays valid once the file is closed, or even deleted
+    with open(file_path, "rb") as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,144 @@
+from .Database import Database
+from .Filters import parseFilter
+from .Protocol import OPERATIONS, DDL_OPERATIONS, encodeFrame, readFrame
+from .constants import SCAN_BATCH_SIZE
+import os
+import socket
+import socketserver
+import threading
+
+
+# Serves a single Database to many clients, over TCP or a Unix socket, so all
+# of them share its cache and its tables. Every connection is handled in its
+# own thread and its requests are answered in order (see Protocol).
+class DatabaseServer:
+    def __init__(self, database, address):
+        self.database = database
+        self.address = address
+        self.ddl_lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        handler = type('Handler', (RequestHandler,), {'database_server': self})
+        if isinstance(self.address, str):
+            # A socket left by a previous run is replaced
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self.server = ThreadingUnixServer(self.address, handler)
+        else:
+            self.server = ThreadingTCPServer(self.address, handler)
+        return self.server
+
+    # Address the server is listening on, with the port picked by the system
+    # when 0 was given
+    def getAddress(self):
+        return self.server.server_address
+
+    def serveForever(self):
+        if self.server is None:
+            self.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.server_close()
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.remove(self.address)
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def execute(self, request):
+        op = request.get('op')
+        if op not in OPERATIONS:
+            return {'error': f"Unknown operation: {op}"}
+
+        args = request.get('args', [])
+        kwargs = request.get('kwargs', {})
+        if op == 'scan' and kwargs.get('filters'):
+            kwargs['filters'] = [parseFilter(text) for text in kwargs['filters']]
+
+        method = getattr(self.database, op)
+        if op in DDL_OPERATIONS:
+            with self.ddl_lock:
+                return {'result': method(*args, **kwargs)}
+        return {'result': method(*args, **kwargs)}
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    database_server = None
+
+    def setup(self):
+        # Small responses are sent right away instead of being coalesced
+        if self.request.family in (socket.AF_INET, socket.AF_INET6):
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        while True:
+            try:
+                request = readFrame(self.request)
+            except (ConnectionError, ValueError):
+                return
+            if request is None:
+                return
+
+            request_id = request.get('id')
+            try:
+                response = self.database_server.execute(request)
+                if request.get('op') == 'scan' and 'result' in response:
+                    self.sendRows(request_id, response['result'])
+                    continue
+            except OSError:
+                # The client is gone, e.g. it left a scan before its end
+                return
+            except Exception as error:
+                response = {'error': f"{type(error).__name__}: {error}"}
+            response['id'] = request_id
+            try:
+                self.request.sendall(encodeFrame(response))
+            except OSError:
+                return
+
+    # The rows of a scan are sent SCAN_BATCH_SIZE at a time as they are read
+    def sendRows(self, request_id, result):
+        status, rows = result
+        if not status:
+            self.request.sendall(encodeFrame({'id': request_id, 'result': result}))
+            return
+
+        batch = []
+        for row in rows:
+            batch.append(list(row))
+            if len(batch) >= SCAN_BATCH_SIZE:
+                self.request.sendall(encodeFrame({'id': request_id, 'rows': batch}))
+                batch = []
+        if batch:
+            self.request.sendall(encodeFrame({'id': request_id, 'rows': batch}))
+        self.request.sendall(encodeFrame({'id': request_id, 'result': (True, None)}))
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+# Address from the command line: a path for a Unix socket, host:port for TCP
+def parseAddress(text):
+    if ':' in text:
+        host, _, port = text.rpartition(':')
+        return host or '127.0.0.1', int(port)
+    return text
+
+
+def serve(base_name, address, **database_options):
+    server = DatabaseServer(Database(base_name, **database_options), address)
+    server.start()
+    print(f"Serving database {base_name} on {server.getAddress()}")
+    server.serveForever()
@@ -1,84 +1,1054 @@
-from .utils import loadJsonFile, updateJsonFile
-from .constants import BASES_PATH
+from .utils import loadJsonFile, replaceJsonFile, checkFileExists, getFileInode
+from .constants import BASES_PATH, DATA_FILE_EXTENSION, WAL_SAVE_NAME, MANIFEST_SAVE_NAME, MEMTABLE_FLUSH_THRESHOLD, SCAN_BATCH_SIZE, COMPACTION_THRESHOLD, CACHE_MAX_BYTES, DEFAULT_STORAGE_FORMAT, BLOOM_ERROR_RATE, INDEX_FAMILY_PREFIX, INDEX_KEY_SEPARATOR, FSYNC_POLICY, FSYNC_INTERVAL_MS, TABLE_LOCK_NAME, COMPACTION_LOCK_NAME, TTL_SWEEP_INTERVAL, SEGMENT_GRACE_PERIOD
+from .WriteAheadLog import WriteAheadLog
+from .Segment import Segment, newBloomStats
+from .RowFormats import ROW_FORMATS
+from .Compactor import COMPACTION_SCHEDULER
+from .Cache import LRUCache
+from .FamilyPool import FamilyPool
+from .FileLock import getFileLock
+from .Versions import latestVersion, oldestVersion, nextVersion, limitVersions, currentTimestamp, expireVersions, rowOldestVersion, restampVersions
+import copy
+import heapq
+import itertools
 import os
+import threading
+import urllib.parse
+
+
+# Tables are instantiated on every command, so the locks guarding the log and
+# the family files are shared by all the instances pointing to the same path
+TABLE_LOCKS = {}
+TABLE_LOCKS_GUARD = threading.Lock()
+
+
+def getTableLock(table_path):
+    with TABLE_LOCKS_GUARD:
+        if table_path not in TABLE_LOCKS:
+            TABLE_LOCKS[table_path] = threading.RLock()
+        return TABLE_LOCKS[table_path]
+
+
+def getPrefixEnd(prefix):
+    # Smallest key greater than all the keys starting with the prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def isInRange(row_id, start_row, stop_row):
+    return (start_row is None or row_id >= start_row) and (stop_row is None or row_id < stop_row)
+
+
+def countCells(row_data):
+    if not row_data:
+        return 0
+    return sum(len(value_versions) for value_versions in row_data.values())
+
+
+# Qualifiers of a row among the given ones, all of them when None
+def projectRow(row_data, qualifiers):
+    if qualifiers is None or row_data is None:
+        return row_data
+    return {col_name: value for col_name, value in row_data.items() if col_name in qualifiers}
+
+
+# Family holding the secondary index of a 'cf:qualifier'. Its rows are keyed
+# by the latest value of the qualifier followed by the row key, so the rows
+# with a value are the ones with its prefix, and hold no cells. The column
+# is escaped in the name, its segments are named after it and ':' is not
+# allowed in the file names of every system.
+def getIndexFamily(column):
+    return INDEX_FAMILY_PREFIX + urllib.parse.quote(column, safe='')
+
+
+def getIndexKey(value, row_id):
+    return str(value) + INDEX_KEY_SEPARATOR + row_id
+
+
+def getLatestValue(row_data, col_name):
+    value_versions = (row_data or {}).get(col_name)
+    if not value_versions:
+        return None
+    return str(value_versions[latestVersion(value_versions)])
+
+
+def tagRows(rows, *tags):
+    for row_id, row_data in rows:
+        yield (row_id,) + tags + (row_data,)
+
+
+# Earliest of the given times, None for the unknown ones
+def getEarliest(*times):
+    return min((time for time in times if time is not None), default=None)
+
+
+# Rows of a family from its segments, oldest first, the newest state of every
+# row wins and the tombstones are dropped
+def mergeStoredRows(segment_rows):
+    streams = [tagRows(rows, priority) for priority, rows in enumerate(reversed(segment_rows))]
+    for row_id, entries in itertools.groupby(heapq.merge(*streams), key=lambda entry: entry[0]):
+        row_data = next(entries)[2]
+        if row_data is not None:
+            yield row_id, row_data
+
+
+# (rows, [cells of every family], [oldest version of every family]) of the
+# stored rows in [start_row, stop_row). 'families' holds the segments of
+# every family and the oldest version its TTL keeps, None without one: the
+# versions before it are not counted and the oldest one left is only looked
+# for then. The families are streamed and merged in key order, only the row
+# being counted is in memory. Runs in a worker of the FamilyPool, possibly
+# in another process.
+def countRange(count_range):
+    table_path, families, start_row, stop_row = count_range
+    cells = [0] * len(families)
+    firsts = [None] * len(families)
+    streams = []
+    for position, (segments, oldest) in enumerate(families):
+        segment_rows = [Segment(table_path + segment).iterRows(start_row, stop_row) for segment in segments]
+        streams.append(tagRows(mergeStoredRows(segment_rows), position))
+
+    rows = 0
+    for _, entries in itertools.groupby(heapq.merge(*streams), key=lambda entry: entry[0]):
+        found = False
+        for _, position, row_data in entries:
+            oldest = families[position][1]
+            if oldest is not None:
+                row_data = expireVersions(row_data, oldest)
+                if row_data is None:
+                    continue
+                firsts[position] = getEarliest(firsts[position], rowOldestVersion(row_data))
+            cells[position] += countCells(row_data)
+            found = True
+        rows += int(found)
+    return rows, cells, firsts
 
 
 class Table:
-    def __init__(self, table_name, base_name, column_families, versions):
+    def __init__(self, table_name, base_name, column_families, versions, cache=None, storage_format=DEFAULT_STORAGE_FORMAT,
+                 indexes=(), bloom_error_rate=BLOOM_ERROR_RATE, pool=None, fsync_policy=FSYNC_POLICY,
+                 fsync_interval=FSYNC_INTERVAL_MS, ttl=None):
         self.table_name = table_name
         self.base_name = base_name
         self.column_families = column_families
+        # 'cf:qualifier' columns with a secondary index
+        self.indexes = list(indexes)
+        # {col_family: seconds its versions are kept}, forever for the others
+        self.ttl = dict(ttl or {})
+        # False positive rate of the Bloom filters of the new segments
+        self.bloom_error_rate = bloom_error_rate
+        self.bloom_stats = newBloomStats()
+        # Reads the families at the same time
+        self.pool = pool if pool is not None else FamilyPool()
+        # Format of the new segments, the existing ones keep theirs
+        self.row_format = ROW_FORMATS[storage_format]
         self.is_enabled = True
         self.table_path = BASES_PATH + base_name + "/" + table_name + '/'
         self.versions = versions
 
-    def loadFamily(self, col_family):
-        return loadJsonFile(self.table_path + col_family + '.json')
+        # Guards the memtable and the segments of the instances of the process
+        self.lock = getTableLock(self.table_path)
+        # Writers of any process hold it before 'lock'; readers never take it,
+        # they see the log, the manifest and the segments written atomically
+        self.write_lock = getFileLock(self.table_path + TABLE_LOCK_NAME)
+        # Compactions run one at a time, without blocking readers and writers
+        self.compaction_lock = getFileLock(self.table_path + COMPACTION_LOCK_NAME)
+        self.log = WriteAheadLog(self.table_path + WAL_SAVE_NAME, fsync_policy, fsync_interval)
+        # Segments and manifests are synced before being renamed into place
+        self.sync_files = fsync_policy != 'never'
+        self.memtable = {}  # {col_family: {row_id: [operations]}}
+        self.pending = 0
+        self.resetPendingStats()
+        self.last_lsn = 0
+        self.flushing = False
 
-    def saveFamily(self, col_family, family_data):
-        return updateJsonFile(self.table_path + col_family + '.json', family_data)
+        self.manifest_path = self.table_path + MANIFEST_SAVE_NAME
+        self.manifest = None
+        self.manifest_inode = None
+        self.segments = {}
+        self.cache = cache if cache is not None else LRUCache(CACHE_MAX_BYTES)
 
-    def put(self, row_id: str, col_family: str, col_name: str, value: str):
-        row_id = str(row_id)
-        col_family = str(col_family)
-        col_name = str(col_name)
-        value = str(value)
+        with self.lock:
+            self.refresh()
 
-        if col_family not in self.column_families:
-            return False, "Column family not found in table"
+    #############################
+    ###   Memtable and Log    ###
+    #############################
+
+    # Catch up with the flushes, compactions and writes done by other instances
+    def refresh(self):
+        while True:
+            inode = getFileInode(self.manifest_path)
+            if self.manifest is None or inode != self.manifest_inode:
+                flushed_lsn = self.manifest['flushed_lsn'] if self.manifest is not None else 0
+                self.manifest = self.loadManifest()
+                self.manifest_inode = inode
+                self.resetPendingStats()
+                # Flushed by another process, the memtable is replayed again
+                # without the operations now in the segments
+                if self.manifest['flushed_lsn'] > flushed_lsn:
+                    self.log.inode = None
+            self.replayLog()
+            # A flush may have published its segments and rotated the log
+            # after the manifest was read
+            if getFileInode(self.manifest_path) == self.manifest_inode:
+                break
+        self.scheduleSweeps()
+
+    def replayLog(self):
+        records, rotated = self.log.read()
+        if rotated:
+            self.memtable = {}
+            self.pending = 0
+            self.resetPendingStats()
+
+        flushed_lsn = self.manifest['flushed_lsn']
+        self.last_lsn = max(self.last_lsn, flushed_lsn)
+        for record in records:
+            # Already in a segment, the log was not truncated after the flush
+            if record.get('lsn') is not None and record['lsn'] <= flushed_lsn:
+                continue
+            self.last_lsn = max(self.last_lsn, record.get('lsn') or 0)
+            self.addToMemtable(record)
+
+    def addToMemtable(self, record):
+        family_ops = self.memtable.setdefault(record['cf'], {})
+        family_ops.setdefault(record['row'], []).append(record)
+        self.pending += 1
+        if record['cf'] in self.column_families:
+            self.markPending(record['row'])
+
+    def logOperation(self, record):
+        return self.logOperations([record])
+
+    # Appends the records to the log with a single write, along with the
+    # changes of the secondary indexes, and adds them to the memtable
+    def logOperations(self, records):
+        # Catch up with the operations appended by other instances first
+        self.refresh()
+        records = records + self.indexRecords(records)
+        # The version of a put is its write time, replayed as it was logged
+        timestamp = currentTimestamp()
+        for lsn, record in enumerate(records, self.last_lsn + 1):
+            record['lsn'] = lsn
+            if record['op'] == 'put':
+                record['ts'] = timestamp
+        if not self.log.extend(records):
+            return False
+        # The records are already in the memtable, skip them on the next replay
+        self.log.offset = os.path.getsize(self.log.log_path)
+        self.last_lsn += len(records)
+        for record in records:
+            self.addToMemtable(record)
 
-        family_data = self.loadFamily(col_family)
-        if family_data is None:
-            return False, "Error loading family data"
+        if self.pending >= MEMTABLE_FLUSH_THRESHOLD and not self.flushing:
+            self.flushing = True
+            threading.Thread(target=self.flush).start()
+        return True
 
+    def applyOperations(self, family_data, row_id, operations):
+        for operation in operations:
+            if operation['op'] == 'put':
+                self.applyPut(family_data, row_id,
+                              operation['col'], operation['value'], operation.get('ts'))
+            elif operation['op'] == 'delete':
+                self.applyDelete(family_data, row_id,
+                                 operation['col'], operation['version'])
+            elif operation['op'] == 'delete_row':
+                family_data.pop(row_id, None)
+            elif operation['op'] == 'index':
+                family_data.setdefault(row_id, {})
+
+    # Records moving the rows touched by 'records' to the entries of the
+    # secondary indexes for their new values. They are computed before the
+    # records are applied.
+    def indexRecords(self, records):
+        indexed = {}
+        for column in self.indexes:
+            col_family, _, col_name = column.partition(':')
+            indexed.setdefault(col_family, []).append(col_name)
+
+        family_ops = {}
+        for record in records:
+            if record['cf'] in indexed:
+                family_ops.setdefault(record['cf'], {}).setdefault(record['row'], []).append(record)
+
+        index_records = []
+        for cf, rows in family_ops.items():
+            for row_id, operations in rows.items():
+                for index_family, key, op in self.indexChanges(cf, indexed[cf], row_id, operations):
+                    index_records.append({'op': op, 'row': key, 'cf': index_family})
+        return index_records
+
+    # (index_family, index_key, 'index' or 'delete_row') of the index entries
+    # that change when the operations are applied to a row
+    def indexChanges(self, col_family, col_names, row_id, operations):
+        row = {}
+        row_data = self.loadRow(col_family, row_id)
+        if row_data is not None:
+            row[row_id] = copy.deepcopy(row_data)
+        self.applyOperations(row, row_id, operations)
+
+        changes = []
+        for col_name in col_names:
+            index_family = getIndexFamily(col_family + ':' + col_name)
+            old_value = getLatestValue(row_data, col_name)
+            new_value = getLatestValue(row.get(row_id), col_name)
+            if old_value == new_value:
+                continue
+            if old_value is not None:
+                changes.append((index_family, getIndexKey(old_value, row_id), 'delete_row'))
+            if new_value is not None:
+                changes.append((index_family, getIndexKey(new_value, row_id), 'index'))
+        return changes
+
+    def applyPut(self, family_data, row_id, col_name, value, timestamp=None):
         if row_id not in family_data:
             family_data[row_id] = {}
 
         if col_name not in family_data[row_id]:
             family_data[row_id][col_name] = {}
 
-        # Handling versions
+        # Handling versions, kept in ascending order (see Versions)
         value_versions = family_data[row_id][col_name]
-        if not value_versions:
-            next_version = 1
-        else:
-            next_version = max([int(key) for key in value_versions.keys()]) + 1
-
-        value_versions[str(next_version)] = value
+        value_versions[nextVersion(value_versions, timestamp)] = value
 
-        # If the number of versions exceeds 'self.versions', remove the version with the smallest key
+        # If the number of versions exceeds 'self.versions', remove the oldest version
         if len(value_versions) > self.versions:
-            min_version = min([int(key) for key in value_versions.keys()])
-            del value_versions[str(min_version)]
+            del value_versions[oldestVersion(value_versions)]
+
+    def applyDelete(self, family_data, row_id, col_name, version):
+        value_versions = family_data.get(row_id, {}).get(col_name, {})
+        value_versions.pop(str(version), None)
+
+    # Writes the rows touched by the memtable to a new segment per family.
+    # Only the writers are held off meanwhile, the readers go on with the
+    # memtable until the segments replace it.
+    def flush(self):
+        with self.write_lock:
+            try:
+                # No writer can add to the memtable while it is written
+                with self.lock:
+                    self.refresh()
+                    memtable = self.memtable
+                    last_lsn = self.last_lsn
+                if not memtable:
+                    return True
+
+                new_segments = {}
+                changes = {}
+                for cf, family_ops in memtable.items():
+                    # Operations on families dropped or renamed since then are discarded
+                    if cf not in self.column_families and cf not in map(getIndexFamily, self.indexes):
+                        continue
+                    segment_name = self.writeSegment(cf, family_ops, changes)
+                    if segment_name is None:
+                        return False
+                    new_segments[cf] = segment_name
+                delta = self.countChanges(changes)
+
+                with self.lock:
+                    # The segments become visible along with the flushed position
+                    self.manifest['flushed_lsn'] = last_lsn
+                    if not self.publishSegments(new_segments, delta):
+                        return False
+
+                    self.log.truncate()
+                    self.memtable = {}
+                    self.pending = 0
+                    self.resetPendingStats()
+                    return True
+            finally:
+                self.flushing = False
+
+    # Applies the operations to the stored rows they touch and writes the
+    # result to a new segment, whose name is returned. The changes of every
+    # row are recorded in 'changes' as {row_id: {col_family: (existed,
+    # cells_before, exists, cells_after, expiration)}} to maintain the table
+    # stats, as seen by the readers once the expired versions are dropped.
+    def writeSegment(self, col_family, family_ops, changes):
+        rows = []
+        for row_id, operations in family_ops.items():
+            row = {}
+            stored_row = self.loadStoredRow(col_family, row_id)
+            if stored_row is not None:
+                row[row_id] = stored_row
+            # Counted before the operations are applied to the stored row
+            before = self.expire(col_family, stored_row)
+            existed, cells_before = before is not None, countCells(before)
+            self.applyOperations(row, row_id, operations)
+            # A missing row is written as a tombstone
+            rows.append((row_id, row.get(row_id)))
+            after = self.expire(col_family, row.get(row_id))
+            changes.setdefault(row_id, {})[col_family] = (
+                existed, cells_before, after is not None, countCells(after),
+                self.getExpiration(col_family, rowOldestVersion(after)))
+
+        segment_name = self.allocateSegment(col_family)
+        if not Segment.write(self.table_path + segment_name, rows, bloom_error_rate=self.bloom_error_rate,
+                             sync=self.sync_files):
+            return None
+        return segment_name
+
+    # Adds the segments to their families with a single manifest write,
+    # along with 'delta' to the table stats, see countChanges
+    def publishSegments(self, new_segments, delta):
+        self.updateStats(delta)
+        families = self.manifest['families']
+        for cf, segment_name in new_segments.items():
+            families.setdefault(cf, self.getSegments(cf)).append(segment_name)
+        expired = self.retireSegments([])
+        if not self.saveManifest():
+            return False
+        self.deleteSegments(expired)
+
+        for cf, segments in families.items():
+            if len(segments) >= COMPACTION_THRESHOLD or self.isSweepDue(cf):
+                COMPACTION_SCHEDULER.schedule(self, cf)
+        return True
+
+    # Families with a TTL are compacted from time to time to purge their
+    # expired versions, even if they have a single segment or no new ones
+    def isSweepDue(self, col_family):
+        ttl = self.ttl.get(col_family)
+        if not ttl or not self.manifest['families'].get(col_family):
+            return False
+        swept = self.manifest.get('swept', {}).get(col_family, 0)
+        return currentTimestamp() - swept >= min(ttl, TTL_SWEEP_INTERVAL) * 1000
+
+    # Checked on every refresh, the sweeps do not wait for the next flush
+    def scheduleSweeps(self):
+        for cf in self.ttl:
+            if self.isSweepDue(cf):
+                COMPACTION_SCHEDULER.schedule(self, cf)
+
+    # Oldest version kept by the TTL of the family, None without a TTL
+    def getOldestVersion(self, col_family):
+        ttl = self.ttl.get(col_family)
+        if not ttl:
+            return None
+        return currentTimestamp() - int(ttl * 1000)
+
+    # Time the TTL of the family expires 'version' at, None without a TTL
+    def getExpiration(self, col_family, version):
+        ttl = self.ttl.get(col_family)
+        if not ttl or version is None:
+            return None
+        return version + int(ttl * 1000) + 1
+
+    # Row without its expired versions. Reads drop them as they go, they are
+    # purged from the segments when the family is compacted.
+    def expire(self, col_family, row_data):
+        oldest = self.getOldestVersion(col_family)
+        if oldest is None:
+            return row_data
+        return expireVersions(row_data, oldest)
+
+    def expireRows(self, col_family, rows):
+        oldest = self.getOldestVersion(col_family)
+        for row_id, row_data in rows:
+            if oldest is not None:
+                row_data = expireVersions(row_data, oldest)
+            if row_data is not None:
+                yield row_id, row_data
+
+    # Row count and cell count of every family of the stored data, kept in
+    # the manifest and updated with the rows written by each new segment.
+    # The changes are counted before the segments are published, looking up
+    # the rows in the families they were not written to.
+    #
+    # Expired versions are not counted. 'expires' is the time the first of
+    # the versions counted expires at, the stats are counted again from then.
+    def countChanges(self, changes):
+        delta = {'rows': 0, 'cells': {}, 'expires': None}
+        if self.manifest.get('stats') is None:
+            return delta
+
+        for row_id, families in changes.items():
+            # Index families hold no rows of the table
+            families = {cf: change for cf, change in families.items() if cf in self.column_families}
+            if not families:
+                continue
+            # The families the row was not written to keep their state
+            others = any(self.expire(cf, self.loadStoredRow(cf, row_id)) is not None
+                         for cf in self.column_families if cf not in families)
+            existed = others or any(change[0] for change in families.values())
+            exists = others or any(change[2] for change in families.values())
+            delta['rows'] += int(exists) - int(existed)
+            for cf, (_, cells_before, _, cells_after, expiration) in families.items():
+                delta['cells'][cf] = delta['cells'].get(cf, 0) + cells_after - cells_before
+                delta['expires'] = getEarliest(delta['expires'], expiration)
+        return delta
+
+    def updateStats(self, delta):
+        stats = self.manifest.get('stats')
+        if stats is None:
+            return
+        stats['rows'] += delta['rows']
+        for cf, cells in delta['cells'].items():
+            stats['cells'][cf] = stats['cells'].get(cf, 0) + cells
+        stats['expires'] = getEarliest(stats.get('expires'), delta['expires'])
+
+    # Stats saved before some of the versions they count expired
+    def isStale(self, stats):
+        return stats.get('expires') is not None and stats['expires'] <= currentTimestamp()
+
+    # Counts the stored rows and cells going through all the segments. The
+    # key space is split at the sparse index entries of the segments into a
+    # range per worker, the ranges are counted at the same time.
+    def countStored(self):
+        families = [(list(self.getSegments(cf)), self.getOldestVersion(cf)) for cf in self.column_families]
+        bounds = self.splitKeys([segment for segments, _ in families for segment in segments], self.pool.workers)
+        ranges = [(self.table_path, families, start_row, stop_row)
+                  for start_row, stop_row in zip([None] + bounds, bounds + [None])]
+        counts = self.pool.mapDecode(countRange, ranges)
+
+        stats = {'rows': 0, 'cells': {cf: 0 for cf in self.column_families}, 'expires': None}
+        for rows, cells, firsts in counts:
+            stats['rows'] += rows
+            for cf, family_cells, first in zip(self.column_families, cells, firsts):
+                stats['cells'][cf] += family_cells
+                stats['expires'] = getEarliest(stats['expires'], self.getExpiration(cf, first))
+        return stats
+
+    # Row keys splitting the rows of the segments in 'parts' ranges of about
+    # the same number of blocks
+    def splitKeys(self, segments, parts):
+        if parts <= 1:
+            return []
+        keys = []
+        for segment in segments:
+            index = self.getSegment(segment).loadIndex()
+            if index:
+                keys.extend(index['keys'])
+        keys.sort()
+        bounds = sorted(set(keys[len(keys) * part // parts] for part in range(1, parts) if keys))
+        # The first range starts before the first key
+        return [key for key in bounds if key != keys[0]]
+
+    # Stats of the table including the memtable. They are computed from scratch
+    # when asked for, or when the table has none yet or they counted versions
+    # expired since then, and saved.
+    def getStats(self, exact=False):
+        with self.lock:
+            self.refresh()
+            stats = self.manifest.get('stats')
+            if not exact and stats is not None and not self.isStale(stats):
+                return self.addPendingStats(copy.deepcopy(stats))
+
+        # The segments may be read by other processes, none can be removed by
+        # a compaction while counting, and no writer changes them meanwhile
+        with self.compaction_lock, self.write_lock:
+            with self.lock:
+                self.refresh()
+            stats = self.countStored()
+            with self.lock:
+                self.manifest['stats'] = stats
+                if not self.saveManifest():
+                    return None
+                return self.addPendingStats(copy.deepcopy(stats))
+
+    # The stats only count the versions kept by the TTL of the families, they
+    # are counted again when it changes
+    def dropStats(self):
+        with self.write_lock, self.lock:
+            self.refresh()
+            self.manifest.pop('stats', None)
+            return self.saveManifest()
+
+    # The share of every row of the memtable in the stats, {row_id: {'rows',
+    # 'cells', 'expires'}}, is kept along with their sum in 'pending_total'.
+    # The rows written since the last count are in 'pending_dirty', only
+    # those are looked up again. All of them are once the stored rows change.
+    def resetPendingStats(self):
+        self.pending_rows = {}
+        self.pending_dirty = set()
+        self.pending_total = {'rows': 0, 'cells': {}, 'expires': None}
+        for cf in self.column_families:
+            self.pending_dirty.update(self.memtable.get(cf, {}).keys())
+
+    def markPending(self, row_id):
+        share = self.pending_rows.pop(row_id, None)
+        if share is not None:
+            self.addShare(self.pending_total, share, -1)
+        self.pending_dirty.add(row_id)
+
+    def addShare(self, total, share, sign):
+        total['rows'] += sign * share['rows']
+        for cf, cells in share['cells'].items():
+            total['cells'][cf] = total['cells'].get(cf, 0) + sign * cells
+        if sign > 0:
+            total['expires'] = getEarliest(total['expires'], share['expires'])
+
+    # Difference the operations of the memtable on a row make to the stats,
+    # until the first of the versions it was counted with expires
+    def countPending(self, row_id):
+        share = {'rows': 0, 'cells': {}, 'expires': None}
+        existed = exists = False
+        for cf in self.column_families:
+            stored_row = self.loadStoredRow(cf, row_id)
+            row_data = self.mergeOperations(cf, row_id, stored_row)
+            stored_row = self.expire(cf, stored_row)
+            existed = existed or stored_row is not None
+            exists = exists or row_data is not None
+            share['cells'][cf] = countCells(row_data) - countCells(stored_row)
+            share['expires'] = getEarliest(share['expires'],
+                                           self.getExpiration(cf, rowOldestVersion(stored_row)),
+                                           self.getExpiration(cf, rowOldestVersion(row_data)))
+        share['rows'] = int(exists) - int(existed)
+        return share
+
+    # Adds the rows in the memtable to the stored stats, only those can differ
+    # from the stored ones, and the Bloom filter stats
+    def addPendingStats(self, stats):
+        stats.pop('expires', None)
+        total = self.pending_total
+        # Some of the versions the rows were counted with expired since then
+        if total['expires'] is not None and total['expires'] <= currentTimestamp():
+            self.resetPendingStats()
+            total = self.pending_total
+
+        for row_id in self.pending_dirty:
+            self.pending_rows[row_id] = share = self.countPending(row_id)
+            self.addShare(total, share, 1)
+        self.pending_dirty = set()
+
+        stats['rows'] += total['rows']
+        for cf, cells in total['cells'].items():
+            stats['cells'][cf] = stats['cells'].get(cf, 0) + cells
+
+        # Lookups of this instance the Bloom filters answered without
+        # reading the segments
+        bloom_stats = dict(self.bloom_stats)
+        checks = bloom_stats['checks']
+        bloom_stats['skip_rate'] = bloom_stats['skips'] / checks if checks else 0.0
+        stats['bloom'] = bloom_stats
+        return stats
+
+    # Merges all the segments of a family into one, dropping the tombstones
+    # and the versions beyond 'self.versions'
+    def compact(self, col_family):
+        with self.compaction_lock:
+            return self.compactSegments(col_family)
+
+    # With 'restamp' the versions numbered from 1 are given timestamps before
+    # it, see restampVersions
+    def compactSegments(self, col_family, restamp=None):
+        with self.write_lock, self.lock:
+            self.refresh()
+            segments = list(self.getSegments(col_family))
+            # A single segment is only rewritten to change its format, or to
+            # purge its expired versions
+            if not segments or (len(segments) == 1 and segments[0].endswith(self.row_format.extension)
+                                and not self.isSweepDue(col_family) and restamp is None):
+                return True
+            segment_name = self.allocateSegment(col_family)
+            swept = currentTimestamp()
+
+        # Segments are immutable, they can be merged without holding the lock,
+        # and they are streamed in key order so the family is never in memory
+        trimmed = {'cells': 0}
+        try:
+            segment_rows = [self.getSegment(segment).iterRows() for segment in segments]
+            rows = self.trimRows(col_family, self.mergeFamily(segment_rows, {}), trimmed)
+            if restamp is not None:
+                rows = ((row_id, restampVersions(row_data, restamp)) for row_id, row_data in rows)
+            if not Segment.write(self.table_path + segment_name, rows, is_sorted=True,
+                                 bloom_error_rate=self.bloom_error_rate, sync=self.sync_files):
+                return False
+        except OSError:
+            return False
+
+        with self.write_lock, self.lock:
+            self.refresh()
+            current = self.getSegments(col_family)
+            if current[:len(segments)] != segments:
+                # The family was compacted, renamed or dropped in the meantime
+                self.getSegment(segment_name).delete()
+                return False
+
+            self.manifest['families'][col_family] = [segment_name] + current[len(segments):]
+            if self.manifest.get('stats') is not None:
+                cells = self.manifest['stats']['cells']
+                cells[col_family] = cells.get(col_family, 0) - trimmed['cells']
+            if col_family in self.ttl:
+                self.manifest.setdefault('swept', {})[col_family] = swept
+            expired = self.retireSegments(segments)
+            if not self.saveManifest():
+                return False
+
+        self.deleteSegments(expired)
+        return True
+
+    # The versions numbered from 1, written before the versions were
+    # timestamps, would all be expired by a TTL. Before a family gets one
+    # they are given the time it is set, the writers wait meanwhile so no
+    # flush copies them to a new segment.
+    def restampFamily(self, col_family):
+        with self.compaction_lock, self.write_lock:
+            if not self.flush():
+                return False
+            return self.compactSegments(col_family, currentTimestamp())
+
+    # Drops the expired versions and the ones beyond 'self.versions', and
+    # the rows left without cells by the TTL. Only the versions beyond
+    # 'self.versions' are counted in 'trimmed', the stats never count the
+    # expired ones.
+    def trimRows(self, col_family, rows, trimmed):
+        oldest = self.getOldestVersion(col_family)
+        for row_id, row_data in rows:
+            if oldest is not None:
+                row_data = expireVersions(row_data, oldest)
+                if row_data is None:
+                    continue
+            trimmed_row = self.trimVersions(row_data)
+            trimmed['cells'] += countCells(row_data) - countCells(trimmed_row)
+            yield row_id, trimmed_row
+
+    def trimVersions(self, row_data):
+        return limitVersions(row_data, self.versions)
+
+    #############################
+    ###    Family Storage     ###
+    #############################
+
+    def loadManifest(self):
+        manifest = loadJsonFile(self.manifest_path)
+        if manifest is None:
+            manifest = {'families': {}, 'next_segment': 1, 'flushed_lsn': 0}
+        return manifest
+
+    def saveManifest(self):
+        if not replaceJsonFile(self.manifest_path, self.manifest, sync=self.sync_files):
+            return False
+        # The stored rows the memtable is counted against may have changed
+        self.resetPendingStats()
+        self.manifest_inode = getFileInode(self.manifest_path)
+        return True
+
+    # Segments of a family from the oldest to the newest. Families not flushed
+    # yet are made of the single file created along with the table.
+    def getSegments(self, col_family):
+        if col_family in self.manifest['families']:
+            return self.manifest['families'][col_family]
+        if checkFileExists(self.table_path + col_family + DATA_FILE_EXTENSION):
+            return [col_family + DATA_FILE_EXTENSION]
+        return []
+
+    def allocateSegment(self, col_family):
+        number = self.manifest['next_segment']
+        self.manifest['next_segment'] = number + 1
+        self.saveManifest()
+        return f"{col_family}.{number:06d}{self.row_format.extension}"
+
+    # Segments replaced by a compaction are kept SEGMENT_GRACE_PERIOD seconds
+    # in 'retired', the readers of other processes may still look them up
+    # through the previous manifest. Returns the ones past it, to be deleted
+    # once the manifest without them is saved.
+    def retireSegments(self, segments):
+        now = currentTimestamp()
+        retired = self.manifest.get('retired', []) + [[segment, now] for segment in segments]
+        expired = [segment for segment, since in retired if now - since >= SEGMENT_GRACE_PERIOD * 1000]
+        self.manifest['retired'] = [[segment, since] for segment, since in retired if segment not in expired]
+        return expired
+
+    def deleteSegments(self, segments):
+        for segment in segments:
+            self.getSegment(segment).delete()
+            self.segments.pop(segment, None)
+
+    def getSegment(self, segment_name):
+        if segment_name not in self.segments:
+            self.segments[segment_name] = Segment(
+                self.table_path + segment_name, self.cache, self.bloom_error_rate, self.bloom_stats)
+        return self.segments[segment_name]
+
+    # Looks the row up in the indexes from the newest segment to the oldest
+    def loadStoredRow(self, col_family, row_id, qualifiers=None):
+        for segment in reversed(self.getSegments(col_family)):
+            found, row_data = self.getSegment(segment).getRow(row_id, qualifiers)
+            if found:
+                return row_data
+        return None
+
+    # Row of a family as seen by the readers, None if it does not exist
+    def loadRow(self, col_family, row_id):
+        with self.lock:
+            self.refresh()
+            row = {}
+            row_data = self.loadStoredRow(col_family, row_id)
+            if row_data is not None:
+                row[row_id] = row_data
+            operations = self.memtable.get(col_family, {}).get(row_id, [])
+            self.applyOperations(row, row_id, operations)
+            return self.expire(col_family, row.get(row_id))
+
+    # Stored row with the pending operations applied, on a copy of it, and
+    # without the expired versions
+    def mergeOperations(self, col_family, row_id, row_data):
+        operations = self.memtable.get(col_family, {}).get(row_id)
+        if not operations:
+            return self.expire(col_family, row_data)
+
+        row = {}
+        if row_data is not None:
+            row[row_id] = copy.deepcopy(row_data)
+        self.applyOperations(row, row_id, operations)
+        return self.expire(col_family, row.get(row_id))
+
+    def renameFamily(self, old_col_family, new_col_family):
+        with self.write_lock, self.lock:
+            self.refresh()
+            segments = []
+            for segment in self.getSegments(old_col_family):
+                new_segment = new_col_family + segment[len(old_col_family):]
+                if not self.getSegment(segment).rename(self.table_path + new_segment):
+                    return False
+                self.segments.pop(segment, None)
+                segments.append(new_segment)
+
+            self.manifest['families'].pop(old_col_family, None)
+            self.manifest['families'][new_col_family] = segments
+            self.manifest.get('swept', {}).pop(old_col_family, None)
+            if self.manifest.get('stats') is not None:
+                cells = self.manifest['stats']['cells']
+                cells[new_col_family] = cells.pop(old_col_family, 0)
+            return self.saveManifest()
 
-        family_data[row_id][col_name] = value_versions
+    def dropFamily(self, col_family):
+        with self.write_lock, self.lock:
+            self.refresh()
+            for segment in self.getSegments(col_family):
+                self.getSegment(segment).delete()
+                self.segments.pop(segment, None)
 
-        saved = self.saveFamily(col_family, family_data)
+            self.manifest['families'].pop(col_family, None)
+            self.manifest.get('swept', {}).pop(col_family, None)
+            # Rows only in this family are gone, they are counted again when needed
+            if col_family in self.column_families:
+                self.manifest.pop('stats', None)
+            return self.saveManifest()
 
-        if not saved:
+    #############################
+    ###       Commands        ###
+    #############################
+
+    def put(self, row_id: str, col_family: str, col_name: str, value: str):
+        row_id = str(row_id)
+        col_family = str(col_family)
+        col_name = str(col_name)
+        value = str(value)
+
+        if col_family not in self.column_families:
+            return False, "Column family not found in table"
+
+        with self.write_lock, self.lock:
+            saved = self.logOperation({'op': 'put', 'row': row_id, 'cf': col_family,
+                                       'col': col_name, 'value': value})
+
+        # Outside of the lock, the concurrent writers share the fsync
+        if not saved or not self.log.sync():
             return False, "Error saving data"
         return True, "Data saved successfully"
 
-    def get(self, row_id: str):
+    # Bulk ingest, the cells are grouped by family and row and merged in
+    # memory, then every family gets a single segment and all of them are
+    # published at once, so either all the cells are visible or none
+    def put_many(self, cells):
+        families = {}
+        timestamp = currentTimestamp()
+        for row_id, col_family, col_name, value in cells:
+            col_family = str(col_family)
+            if col_family not in self.column_families:
+                return False, "Column family not found in table"
+
+            family_ops = families.setdefault(col_family, {})
+            family_ops.setdefault(str(row_id), []).append(
+                {'op': 'put', 'col': str(col_name), 'value': str(value), 'ts': timestamp})
+
+        # The readers are only held off while the segments are published
+        with self.write_lock:
+            # The rows are merged with the stored ones, pending writes go first
+            if not self.flush():
+                return False, "Error saving data"
+
+            # The index entries are written along with the rows
+            records = [dict(operation, row=row_id, cf=cf) for cf, family_ops in families.items()
+                       for row_id, operations in family_ops.items() for operation in operations]
+            for record in self.indexRecords(records):
+                families.setdefault(record['cf'], {}).setdefault(record['row'], []).append({'op': record['op']})
+
+            new_segments = {}
+            changes = {}
+            for cf, family_ops in families.items():
+                segment_name = self.writeSegment(cf, family_ops, changes)
+                if segment_name is None:
+                    return False, "Error saving data"
+                new_segments[cf] = segment_name
+            delta = self.countChanges(changes)
+
+            with self.lock:
+                if not self.publishSegments(new_segments, delta):
+                    return False, "Error saving data"
+        return True, "Data saved successfully"
+
+    # Only the families in 'columns' are read, and only their qualifiers
+    # given in it are decoded, see parseColumns. With 'versions' only the
+    # latest ones of every cell are returned, after the cells are filtered
+    # by 'row_filter' (see Filters).
+    def get(self, row_id: str, columns=None, versions=None, row_filter=None):
         row_id = str(row_id)
+        status, qualifiers = self.parseColumns(columns)
+        if not status:
+            return False, qualifiers
+        if versions is not None:
+            try:
+                versions = int(versions)
+            except (TypeError, ValueError):
+                return False, "Versions should be an integer"
+            if versions < 1:
+                return False, "Versions should be at least 1"
 
         all_data = {}
-        # This will get all the data for the specified row_id
-        for cf in self.column_families:
-            family_data = self.loadFamily(cf)
-            if row_id in family_data:
-                all_data[cf] = family_data[row_id]
+        with self.lock:
+            self.refresh()
+            # This will get all the data for the specified row_id
+            stored_rows = self.pool.map(lambda family: self.loadStoredRow(family[0], row_id, family[1]),
+                                        qualifiers.items())
+            for (cf, col_names), row_data in zip(qualifiers.items(), stored_rows):
+                row_data = projectRow(self.mergeOperations(cf, row_id, row_data), col_names)
+                if row_data and row_filter is not None:
+                    row_data = row_filter.filterCells(cf, row_data) or None
+                if row_data is not None and (col_names is None or row_data):
+                    all_data[cf] = row_data if versions is None else limitVersions(row_data, versions)
         return True, all_data
 
-    def scan(self):
-        all_data = {}
-        for cf in self.column_families:
-            family_data = self.loadFamily(cf)
-            for id, data in family_data.items():
-                if id not in all_data:
-                    all_data[id] = {}
-                all_data[id][cf] = data
-        return True, all_data
+    # Returns an iterator over the (row_id, {col_family: row_data}) in
+    # [start_row, stop_row) in key order, reading the segments as it goes
+    # 'row_filter' is a Filter evaluated while the rows are read, see Filters
+    def scan(self, start_row=None, stop_row=None, prefix=None, limit=None, columns=None, row_filter=None):
+        if prefix:
+            start_row = prefix if start_row is None else max(start_row, prefix)
+            prefix_end = getPrefixEnd(prefix)
+            stop_row = prefix_end if stop_row is None else min(stop_row, prefix_end)
+
+        status, qualifiers = self.parseColumns(columns)
+        if not status:
+            return False, qualifiers
+        families = list(qualifiers.keys())
+
+        # The segments are opened and the memtable copied now, later writes
+        # are not seen by the scan
+        with self.lock:
+            self.refresh()
+            streams = [self.iterFamily(cf, start_row, stop_row, qualifiers[cf], row_filter) for cf in families]
+        # Every family is read ahead in its own thread while the rows are merged
+        streams = [self.pool.prefetch(stream, SCAN_BATCH_SIZE) for stream in streams]
+
+        return True, self.iterScan(families, streams, qualifiers, limit, row_filter)
+
+    # Returns {row_id: {col_family: row_data}} of the rows found among the
+    # given ones. The segments of every family are looked up once for all
+    # the rows, sorted by key, under a single refresh of the table.
+    def multiGet(self, row_ids, columns=None):
+        status, qualifiers = self.parseColumns(columns)
+        if not status:
+            return False, qualifiers
+        row_ids = sorted(set(str(row_id) for row_id in row_ids))
+
+        rows = {}
+        with self.lock:
+            self.refresh()
+            families = list(qualifiers.items())
+            family_rows = self.pool.map(lambda family: self.lookupRows(family[0], row_ids, family[1]), families)
+            for (cf, _), stored_rows in zip(families, family_rows):
+                for row_id, row_data in stored_rows.items():
+                    rows.setdefault(row_id, {})[cf] = row_data
+        return True, {row_id: rows[row_id] for row_id in row_ids if row_id in rows}
+
+    # {row_id: row_data} of the rows of a family found among the given ones
+    def lookupRows(self, col_family, row_ids, qualifiers):
+        segments = [self.getSegment(segment) for segment in reversed(self.getSegments(col_family))]
+        rows = {}
+        for row_id in row_ids:
+            row_data = None
+            for segment in segments:
+                found, row_data = segment.getRow(row_id, qualifiers)
+                if found:
+                    break
+            row_data = projectRow(self.mergeOperations(col_family, row_id, row_data), qualifiers)
+            if row_data:
+                rows[row_id] = row_data
+        return rows
+
+    # {col_family: set of qualifiers or None for all of them} from a list of
+    # 'cf' or 'cf:qualifier', all the families when no columns are given
+    def parseColumns(self, columns):
+        if not columns:
+            return True, {cf: None for cf in self.column_families}
+
+        qualifiers = {}
+        for column in columns:
+            col_family, _, col_name = column.partition(':')
+            if col_family not in self.column_families:
+                return False, "Column family not found in table"
+            if not col_name:
+                qualifiers[col_family] = None
+            elif qualifiers.get(col_family, set()) is not None:
+                qualifiers.setdefault(col_family, set()).add(col_name)
+
+        # Keep the order of the table definition
+        return True, {cf: qualifiers[cf] for cf in self.column_families if cf in qualifiers}
+
+    def iterFamily(self, col_family, start_row, stop_row, qualifiers=None, row_filter=None):
+        segment_rows = [self.getSegment(segment).iterRows(start_row, stop_row, qualifiers, row_filter)
+                        for segment in self.getSegments(col_family)]
+        family_ops = {row_id: list(operations)
+                      for row_id, operations in self.memtable.get(col_family, {}).items()
+                      if isInRange(row_id, start_row, stop_row)
+                      and (row_filter is None or row_filter.filterRowKey(row_id))}
+        return self.expireRows(col_family, self.mergeFamily(segment_rows, family_ops))
+
+    def mergeFamily(self, segment_rows, family_ops):
+        # Lower priorities are newer: the memtable, then the segments from the newest
+        streams = [tagRows(((row_id, None) for row_id in sorted(family_ops)), 0)]
+        for priority, rows in enumerate(reversed(segment_rows), 1):
+            streams.append(tagRows(rows, priority))
+
+        for row_id, entries in itertools.groupby(heapq.merge(*streams), key=lambda entry: entry[0]):
+            entries = list(entries)
+            if entries[0][1] == 0:
+                row = {}
+                if len(entries) > 1 and entries[1][2] is not None:
+                    row[row_id] = entries[1][2]
+                self.applyOperations(row, row_id, family_ops[row_id])
+                row_data = row.get(row_id)
+            else:
+                row_data = entries[0][2]
+
+            if row_data is not None:
+                yield row_id, row_data
+
+    def iterScan(self, families, streams, qualifiers, limit, row_filter=None):
+        streams = [tagRows(stream, position) for position, stream in enumerate(streams)]
+        count = 0
+        if limit is not None and limit <= 0:
+            return
+
+        for row_id, entries in itertools.groupby(heapq.merge(*streams), key=lambda entry: entry[0]):
+            row = {}
+            for _, position, row_data in entries:
+                cf = families[position]
+                row_data = projectRow(row_data, qualifiers[cf])
+                if row_data and row_filter is not None:
+                    row_data = row_filter.filterCells(cf, row_data)
+                if row_data:
+                    row[cf] = row_data
+
+            if row and (row_filter is None or row_filter.filterRow(row)):
+                yield row_id, row
+                count += 1
+                if limit is not None and count >= limit:
+                    return
 
     # ‘<table name>’, ‘<row>’, ‘<column name >’, ‘<time stamp>’
     def delete(self, row_id: str, col_family: str, col_name: str, version: str):
@@ -94,49 +1064,237 @@ class Table:
         if col_family not in self.column_families:
             return False, "Column family not found in table"
 
-        family_data = self.loadFamily(col_family)
+        with self.write_lock, self.lock:
+            row_data = self.loadRow(col_family, row_id)
 
-        if row_id not in family_data:
-            return False, "Row not found in table"
+            if row_data is None:
+                return False, "Row not found in table"
 
-        if col_name not in family_data[row_id]:
-            return False, "Column name not found in column family"
+            if col_name not in row_data:
+                return False, "Column name not found in column family"
 
-        value_versions = family_data[row_id][col_name]
+            value_versions = row_data[col_name]
 
-        if str(version) not in value_versions.keys():
-            return False, "This version does not exist"
+            if str(version) not in value_versions.keys():
+                return False, "This version does not exist"
 
-        del value_versions[str(version)]  # Delete the specified version
+            saved = self.logOperation({'op': 'delete', 'row': row_id, 'cf': col_family,
+                                       'col': col_name, 'version': version})
 
-        # If the number of versions exceeds 'self.versions', remove the version with the smallest key
-        if len(value_versions) > self.versions:
-            min_version = min([int(key) for key in value_versions.keys()])
-            del value_versions[str(min_version)]
-
-        family_data[row_id][col_name] = value_versions
-
-        return self.saveFamily(col_family, family_data), "Data deleted successfully"
+        if not saved or not self.log.sync():
+            return False, "Error saving data"
+        return True, "Data deleted successfully"
 
     def delete_all(self, row_id: str):
         row_id = str(row_id)
 
         # This will delete for all column families the row with the specified row_id
-
-        for cf in self.column_families:
-            family_data = self.loadFamily(cf)
-            if row_id in family_data:
-                del family_data[row_id]
-                if not self.saveFamily(cf, family_data):
-                    return False, "Error saving data"
+        with self.write_lock, self.lock:
+            if not self.logOperations([{'op': 'delete_row', 'row': row_id, 'cf': cf} for cf in self.column_families]):
+                return False, "Error saving data"
+        if not self.log.sync():
+            return False, "Error saving data"
         return True, "Data deleted successfully"
 
-    def count(self):
-        rows = set()
-        for cf in self.column_families:
-            family_data = self.loadFamily(cf)
-            if family_data is None:
-                return False, "Error loading family data"
-            family_data_keys = family_data.keys()
-            rows.update(family_data_keys)
-        return True, len(rows)
+    # Puts the value only if the latest version of the column is 'expected',
+    # or if the column has no value when 'expected' is None. The check and the
+    # put are done under the write lock, no other writer can come in between.
+    def check_and_put(self, row_id: str, col_family: str, col_name: str, expected, value: str):
+        row_id = str(row_id)
+        col_family = str(col_family)
+        col_name = str(col_name)
+        value = str(value)
+
+        if col_family not in self.column_families:
+            return False, "Column family not found in table"
+
+        with self.write_lock, self.lock:
+            current = getLatestValue(self.loadRow(col_family, row_id), col_name)
+            if current != (None if expected is None else str(expected)):
+                return False, "Value does not match the expected one"
+            saved = self.logOperation({'op': 'put', 'row': row_id, 'cf': col_family,
+                                       'col': col_name, 'value': value})
+
+        if not saved or not self.log.sync():
+            return False, "Error saving data"
+        return True, "Data saved successfully"
+
+    # Adds 'delta' to the integer in the latest version of the column, a
+    # missing one counts as 0, and returns (True, new value)
+    def increment(self, row_id: str, col_family: str, col_name: str, delta=1):
+        row_id = str(row_id)
+        col_family = str(col_family)
+        col_name = str(col_name)
+
+        try:
+            delta = int(delta)
+        except (TypeError, ValueError):
+            return False, "Delta should be an integer"
+
+        if col_family not in self.column_families:
+            return False, "Column family not found in table"
+
+        with self.write_lock, self.lock:
+            current = getLatestValue(self.loadRow(col_family, row_id), col_name)
+            try:
+                value = int(current or 0) + delta
+            except ValueError:
+                return False, "Value is not an integer"
+            saved = self.logOperation({'op': 'put', 'row': row_id, 'cf': col_family,
+                                       'col': col_name, 'value': str(value)})
+
+        if not saved or not self.log.sync():
+            return False, "Error saving data"
+        return True, value
+
+    # Applies a list of mutations, dicts with an 'op' among 'put', 'delete'
+    # and 'delete_row' and the arguments of the command of the same name.
+    # Every mutation is checked against the rows as left by the previous ones
+    # and the valid ones are logged with a single write. Returns the
+    # (status, message) of every mutation.
+    def mutate(self, mutations):
+        results = []
+        records = []
+        with self.write_lock, self.lock:
+            self.refresh()
+            # {col_family: {row_id: row_data}} of the rows touched so far
+            rows = {cf: {} for cf in self.column_families}
+            loaded = set()
+            for mutation in mutations:
+                status, mutation_records = self.checkMutation(mutation, rows, loaded)
+                if not status:
+                    results.append((False, mutation_records))
+                    continue
+
+                for record in mutation_records:
+                    self.applyOperations(rows[record['cf']], record['row'], [record])
+                records.extend(mutation_records)
+                if mutation['op'] == 'put':
+                    results.append((True, "Data saved successfully"))
+                else:
+                    results.append((True, "Data deleted successfully"))
+
+            if records and not self.logOperations(records):
+                return False, "Error saving data"
+        if records and not self.log.sync():
+            return False, "Error saving data"
+        return True, results
+
+    # Returns (True, records) with the log records of a mutation, or (False,
+    # message). The rows it reads are added to 'rows'.
+    def checkMutation(self, mutation, rows, loaded):
+        operation = mutation.get('op')
+        if operation not in ('put', 'delete', 'delete_row'):
+            return False, f"Unknown mutation: {operation}"
+        if mutation.get('row') is None:
+            return False, "Row id is required"
+        row_id = str(mutation['row'])
+
+        # A row deletion is a mutation per family
+        if operation == 'delete_row':
+            for cf in self.column_families:
+                self.loadMutationRow(rows, loaded, cf, row_id)
+            return True, [{'op': 'delete_row', 'row': row_id, 'cf': cf} for cf in self.column_families]
+
+        col_family = str(mutation.get('cf'))
+        if col_family not in self.column_families:
+            return False, "Column family not found in table"
+        col_name = str(mutation.get('col'))
+        row_data = self.loadMutationRow(rows, loaded, col_family, row_id)
+
+        if operation == 'put':
+            return True, [{'op': 'put', 'row': row_id, 'cf': col_family,
+                           'col': col_name, 'value': str(mutation.get('value'))}]
+
+        try:
+            version = int(mutation.get('version'))
+        except (TypeError, ValueError):
+            return False, "Version should be an integer"
+        if row_data is None:
+            return False, "Row not found in table"
+        if col_name not in row_data:
+            return False, "Column name not found in column family"
+        if str(version) not in row_data[col_name].keys():
+            return False, "This version does not exist"
+        return True, [{'op': 'delete', 'row': row_id, 'cf': col_family,
+                       'col': col_name, 'version': version}]
+
+    # Row as left by the mutations of the batch so far, read once per batch
+    def loadMutationRow(self, rows, loaded, col_family, row_id):
+        family_data = rows[col_family]
+        if (col_family, row_id) not in loaded:
+            loaded.add((col_family, row_id))
+            row_data = self.loadRow(col_family, row_id)
+            if row_data is not None:
+                family_data[row_id] = copy.deepcopy(row_data)
+        return family_data.get(row_id)
+
+    # Writes the index of a column from the rows stored in the table
+    def buildIndex(self, column):
+        col_family, _, col_name = column.partition(':')
+        index_family = getIndexFamily(column)
+        with self.write_lock, self.lock:
+            # The memtable is empty once flushed, the stored rows are all of them
+            if not self.flush():
+                return False
+
+            family_ops = {}
+            segment_rows = [self.getSegment(segment).iterRows(qualifiers={col_name})
+                            for segment in self.getSegments(col_family)]
+            for row_id, row_data in self.mergeFamily(segment_rows, {}):
+                value = getLatestValue(row_data, col_name)
+                if value is not None:
+                    family_ops[getIndexKey(value, row_id)] = [{'op': 'index'}]
+
+            # Entries left by a previous index of the column are dropped
+            if not self.dropFamily(index_family):
+                return False
+            segment_name = self.writeSegment(index_family, family_ops, {})
+            if segment_name is None:
+                return False
+            return self.publishSegments({index_family: segment_name}, self.countChanges({}))
+
+    # Row keys with 'value' as the latest version of an indexed column, in
+    # key order
+    def iterIndex(self, column, value):
+        prefix = getIndexKey(value, '')
+        with self.lock:
+            self.refresh()
+            rows = self.iterFamily(getIndexFamily(column), prefix, getPrefixEnd(prefix))
+        return (key[len(prefix):] for key, _ in rows)
+
+    # Rows with 'value' as the latest version of an indexed column, found
+    # through its index
+    def queryIndex(self, column, value, columns=None, limit=None):
+        if column not in self.indexes:
+            return False, "Index not found in table"
+        col_family, _, col_name = column.partition(':')
+        value = str(value)
+
+        row_ids = list(itertools.islice(self.iterIndex(column, value), limit))
+        # The indexed column is read along to check it, it may have changed
+        # since the index was read
+        status, qualifiers = self.parseColumns(columns)
+        if not status:
+            return False, qualifiers
+        status, rows = self.multiGet(row_ids, columns and list(columns) + [column])
+        if not status:
+            return False, rows
+
+        result = {}
+        for row_id, row in rows.items():
+            if getLatestValue(row.get(col_family), col_name) != value:
+                continue
+            row = {cf: projectRow(row_data, qualifiers[cf]) for cf, row_data in row.items() if cf in qualifiers}
+            row = {cf: row_data for cf, row_data in row.items() if row_data}
+            if row:
+                result[row_id] = row
+        return True, result
+
+    def count(self, exact=False):
+        # Kept up to date in the stats, 'exact' counts the rows again and
+        # repairs them
+        stats = self.getStats(exact)
+        if stats is None:
+            return False, "Error saving table stats"
+        return True, stats['rows']
@@ -0,0 +1,104 @@
+from .constants import FIRST_TIMESTAMP_VERSION
+import itertools
+import time
+
+
+# The versions of a cell, {version: value}, are kept in ascending order of
+# version: puts add the next one at the end and the oldest ones are dropped
+# from the start. Both ends are found without parsing the other keys, and the
+# order survives the row formats and the copies of the rows.
+#
+# Versions are the write timestamps of the cells, in milliseconds since the
+# epoch. The ones written before were small numbers, as old as the epoch,
+# see restampVersions.
+
+def currentTimestamp():
+    return int(time.time() * 1000)
+
+
+def latestVersion(value_versions):
+    return next(reversed(value_versions))
+
+
+def oldestVersion(value_versions):
+    return next(iter(value_versions))
+
+
+def nextVersion(value_versions, timestamp=None):
+    version = int(latestVersion(value_versions)) + 1 if value_versions else 1
+    # Never below the latest one, the writes of a millisecond stay apart
+    if timestamp is not None:
+        version = max(version, int(timestamp))
+    return str(version)
+
+
+# {version: value} of the last 'count' versions, in ascending order, read
+# from the end
+def latestVersions(value_versions, count):
+    if len(value_versions) <= count:
+        return value_versions
+    latest = list(itertools.islice(reversed(value_versions.items()), count))
+    return dict(reversed(latest))
+
+
+# Row with the last 'count' versions of every cell
+def limitVersions(row_data, count):
+    if row_data is None:
+        return None
+    return {col_name: latestVersions(value_versions, count) for col_name, value_versions in row_data.items()}
+
+
+# Cells written by hand, or by other tools, may come in any order
+def sortVersions(row_data):
+    if not isinstance(row_data, dict):
+        return row_data
+    return {col_name: dict(sorted(value_versions.items(), key=lambda item: int(item[0])))
+            if isinstance(value_versions, dict) else value_versions
+            for col_name, value_versions in row_data.items()}
+
+
+# Row with the versions numbered from 1 turned into timestamps, in the
+# milliseconds before 'timestamp' and before the first real timestamp of
+# their cell, keeping their order
+def restampVersions(row_data, timestamp):
+    if not isinstance(row_data, dict):
+        return row_data
+
+    restamped = {}
+    for col_name, value_versions in row_data.items():
+        if isinstance(value_versions, dict):
+            numbered = [version for version in value_versions if int(version) < FIRST_TIMESTAMP_VERSION]
+            if numbered:
+                stamped = [int(version) for version in value_versions if int(version) >= FIRST_TIMESTAMP_VERSION]
+                first = min(stamped + [timestamp]) - len(numbered)
+                renamed = {version: str(first + position) for position, version in enumerate(numbered)}
+                value_versions = {renamed.get(version, version): value for version, value in value_versions.items()}
+        restamped[col_name] = value_versions
+    return restamped
+
+
+# Oldest version among the cells of a row, None when it has none
+def rowOldestVersion(row_data):
+    if not isinstance(row_data, dict):
+        return None
+    return min((int(oldestVersion(value_versions)) for value_versions in row_data.values()
+                if isinstance(value_versions, dict) and value_versions), default=None)
+
+
+# Row without the versions written before 'oldest', None when it had cells
+# and none is left. The expired versions are the first ones of every cell.
+def expireVersions(row_data, oldest):
+    if not isinstance(row_data, dict):
+        return row_data
+
+    expired = False
+    kept = {}
+    for col_name, value_versions in row_data.items():
+        if isinstance(value_versions, dict) and value_versions and int(oldestVersion(value_versions)) < oldest:
+            expired = True
+            value_versions = {version: value for version, value in value_versions.items() if int(version) >= oldest}
+        if value_versions:
+            kept[col_name] = value_versions
+    if not expired:
+        return row_data
+    return kept or None
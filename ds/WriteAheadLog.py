@@ -0,0 +1,127 @@
+from .utils import appendJsonLines, loadJsonLines, getFileInode, replaceFile, syncDirectory
+from .constants import FSYNC_POLICIES, FSYNC_POLICY, FSYNC_INTERVAL_MS
+import os
+import threading
+
+
+# Append-only log of the mutations of a table, one JSON line per operation.
+# It is replayed into the memtable when a table is opened and truncated once
+# its content has been flushed into the column family files.
+#
+# The appends reach the disk according to 'fsync_policy':
+#   'always'  sync waits until they are on disk. The writers waiting at the
+#             same time share a single fsync (group commit).
+#   'batch'   they are synced in the background at most 'fsync_interval' ms
+#             after being appended, a crash loses at most that window.
+#   'never'   the system writes them back whenever it wants.
+class WriteAheadLog:
+    def __init__(self, log_path, fsync_policy=FSYNC_POLICY, fsync_interval=FSYNC_INTERVAL_MS):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy {fsync_policy}")
+        self.log_path = log_path
+        self.offset = 0
+        self.inode = None
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.written = 0  # appends done
+        self.synced = 0  # appends known to be on disk
+        self.linked = None  # inode of the log whose directory entry is on disk
+        self.sync_lock = threading.Lock()
+        self.timer = None
+
+    # Called once the log has been read up to its end, with the other
+    # writers held off
+    def extend(self, records):
+        self.cutTornRecord()
+        return self.appended(appendJsonLines(self.log_path, records))
+
+    # A writer that crashed in the middle of an append leaves a torn record
+    # after the last one read. It is cut off first, the records appended
+    # after it would be glued to it and never replayed.
+    def cutTornRecord(self):
+        try:
+            if os.path.getsize(self.log_path) > self.offset:
+                os.truncate(self.log_path, self.offset)
+        except FileNotFoundError:
+            pass
+
+    def appended(self, saved):
+        if saved:
+            self.written += 1
+            if self.fsync_policy == 'batch':
+                self.scheduleSync()
+        return saved
+
+    # Called once the appends are done, without holding the table lock so
+    # the writers appending meanwhile join the same fsync
+    def sync(self):
+        if self.fsync_policy != 'always':
+            return True
+        return self.syncAppends()
+
+    def syncAppends(self):
+        target = self.written
+        with self.sync_lock:
+            # The fsync of another writer covered the appends
+            if self.synced >= target:
+                return True
+            target = self.written
+            try:
+                descriptor = os.open(self.log_path, os.O_WRONLY | os.O_APPEND)
+            except FileNotFoundError:
+                # Truncated, its records were synced into the segments
+                self.synced = target
+                return True
+            try:
+                os.fsync(descriptor)
+                # Created by the first append, its entry in the directory
+                # has to reach the disk as well
+                inode = os.fstat(descriptor).st_ino
+                if inode != self.linked:
+                    syncDirectory(os.path.dirname(self.log_path))
+                    self.linked = inode
+            except OSError:
+                return False
+            finally:
+                os.close(descriptor)
+            self.synced = target
+            return True
+
+    def scheduleSync(self):
+        with self.sync_lock:
+            if self.timer is not None:
+                return
+            self.timer = threading.Timer(self.fsync_interval / 1000, self.syncBatch)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def syncBatch(self):
+        with self.sync_lock:
+            self.timer = None
+        self.syncAppends()
+
+    # Returns the records appended since the last read, and whether the log
+    # was rotated in between (in that case all of its records are returned)
+    def read(self):
+        inode = getFileInode(self.log_path)
+        rotated = inode != self.inode
+        if rotated:
+            self.offset = 0
+            self.inode = inode
+
+        records, self.offset = loadJsonLines(self.log_path, self.offset)
+        return records, rotated
+
+    def truncate(self):
+        # Replace the file instead of truncating it in place, so any other
+        # reader notices the new inode and replays from the beginning
+        temp_path = self.log_path + '.tmp'
+        with open(temp_path, "w"):
+            pass
+        synced = self.fsync_policy != 'never'
+        replaceFile(temp_path, self.log_path, sync=synced)
+        self.offset = 0
+        self.inode = getFileInode(self.log_path)
+        if synced:
+            self.linked = self.inode
+        return True
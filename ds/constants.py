@@ -1,5 +1,7 @@
 BASES_PATH = 'bases/'
 DATA_FILE_EXTENSION = '.json'
+BINARY_FILE_EXTENSION = '.bin'
+INDEX_FILE_EXTENSION = '.idx'
 VERSION = 1
 WHOAMI = 'admin'
 SERVERS = ['Server1']
@@ -15,4 +17,34 @@ METADATA_TEMPLATE = {
 }
 METADATA_SAVE_NAME = 'metadata.json'
 
+STORAGE_FORMATS = ['json', 'binary']  # layouts of the column family segments
+DEFAULT_STORAGE_FORMAT = 'json'
+
+WAL_SAVE_NAME = 'wal.log'
+TABLE_LOCK_NAME = 'table.lock'  # held by the writers of a table, in any process
+COMPACTION_LOCK_NAME = 'compaction.lock'  # held by the compactions of a table
+METADATA_LOCK_NAME = 'metadata.lock'  # held by the commands changing the metadata
+MANIFEST_SAVE_NAME = 'manifest.json'
+MEMTABLE_FLUSH_THRESHOLD = 1000  # logged operations kept in memory before flushing
+FSYNC_POLICIES = ['always', 'batch', 'never']  # when the appends to the log reach the disk
+FSYNC_POLICY = 'always'
+FSYNC_INTERVAL_MS = 10  # longest delay of the background fsync of the 'batch' policy
+COMPACTION_THRESHOLD = 4  # segments of a family before merging them in the background
+SEGMENT_GRACE_PERIOD = 60  # seconds the segments replaced by a compaction are kept for the readers of other processes
+FIRST_TIMESTAMP_VERSION = 10 ** 12  # versions below it were numbered from 1, before the versions were timestamps
+TTL_SWEEP_INTERVAL = 3600  # longest time in seconds between two compactions purging the expired cells of a family
+CACHE_MAX_BYTES = 256 * 1024 * 1024  # budget of the segment index and table cache of a database
+CACHE_TABLE_SIZE = 4096  # approximate size charged for a cached table
+SCAN_BATCH_SIZE = 1000  # rows read at once from every segment by a scan
+SEGMENT_BLOCK_SIZE = 64  # rows of a segment between two entries of its sparse index
+BLOOM_ERROR_RATE = 0.01  # default rate of false positives of the Bloom filter of a segment
+IO_WORKERS = 4  # families of a table read at the same time
+IO_POOL_KIND = 'thread'  # 'process' decodes whole families in processes
+ASYNC_MAX_CONCURRENCY = 8  # calls of an AsyncDatabase running at the same time
+SERVER_ADDRESS = '127.0.0.1:7070'  # host:port, or the path of a Unix socket, of the database server
+CLIENT_POOL_SIZE = 4  # connections kept open by a client of the database server
+JSON_CHUNK_SIZE = 64 * 1024  # bytes read at once when streaming a JSON file
+INDEX_FAMILY_PREFIX = '#index.'  # families holding the secondary index of a 'cf:qualifier'
+INDEX_KEY_SEPARATOR = '\x00'  # between the value and the row key in the index rows
+
 PRINT_DICTS_WITH = 'json'  # avaible 'json', 'yaml' or 'pprint'
@@ -1,8 +1,9 @@
 import os
 import errno
 import json
-from .constants import PRINT_DICTS_WITH
+from .constants import PRINT_DICTS_WITH, JSON_CHUNK_SIZE
 import shutil
+import threading
 
 
 def checkFileExists(file_path):
@@ -47,22 +48,134 @@ def loadJsonFile(file_path):
     return None
 
 
-def writeJsonFile(file_path, data):
-    with open(file_path, "w") as file:
-        json.dump(data, file, indent=4)
-        return True
+def iterJsonObject(file_path, chunk_size=JSON_CHUNK_SIZE):
+    # Yields the (key, value) pairs of the JSON object stored in the file one
+    # by one, whatever its formatting, holding only the current pair in memory
+    decoder = json.JSONDecoder()
+    with open(file_path, "r") as file:
+        buffer = ""
+
+        def peek():
+            nonlocal buffer
+            while True:
+                buffer = buffer.lstrip()
+                if buffer:
+                    return buffer[0]
+                buffer = file.read(chunk_size)
+                if not buffer:
+                    raise ValueError("Unexpected end of JSON file " + file_path)
+
+        def expect(characters):
+            nonlocal buffer
+            character = peek()
+            if character not in characters:
+                raise ValueError(f"Expected one of {characters!r} in {file_path}, found {character!r}")
+            buffer = buffer[1:]
+            return character
+
+        def decode():
+            nonlocal buffer
+            peek()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    end = None
+
+                # Incomplete value, or a number that may go on in the next chunk
+                if end is None or end == len(buffer):
+                    chunk = file.read(chunk_size)
+                    if chunk:
+                        buffer += chunk
+                        continue
+                    if end is None:
+                        raise ValueError("Unexpected end of JSON file " + file_path)
+
+                buffer = buffer[end:]
+                return value
+
+        expect("{")
+        if peek() == "}":
+            return
+        while True:
+            key = decode()
+            expect(":")
+            yield key, decode()
+            if expect(",}") == "}":
+                return
+
+
+def writeJsonFile(file_path, data, sync=True):
+    return replaceJsonFile(file_path, data, sync=sync)
+
+
+def replaceJsonFile(file_path, data, indent=4, sync=True):
+    # Write next to the target and rename, readers never see a partial file
+    # and a crash leaves either the old or the new content
+    temp_path = getTempPath(file_path)
+    with open(temp_path, "w") as file:
+        json.dump(data, file, indent=indent,
+                  separators=None if indent else (',', ':'))
+        if sync:
+            syncFile(file)
+    return replaceFile(temp_path, file_path, sync)
+
+
+# Temporary file of a writer of 'file_path', the processes and threads
+# rewriting the same file at once never share it
+def getTempPath(file_path):
+    return f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+# Renames over the target, with 'sync' the rename is on disk when it returns
+def replaceFile(temp_path, file_path, sync=True):
+    os.replace(temp_path, file_path)
+    if sync:
+        syncDirectory(os.path.dirname(file_path))
+    return True
+
+
+def syncFile(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+# Windows cannot open a directory to sync it, its renames are written along
+# with the file system metadata
+def syncDirectory(directory_path):
+    if os.name == 'nt':
+        return
+    descriptor = os.open(directory_path or '.', os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def getFileInode(file_path):
+    if not checkFileExists(file_path):
+        return None
+    return os.stat(file_path).st_ino
+
+
+def getFileToken(file_path):
+    # Changes whenever the file is rewritten, used to validate cached content
+    if not checkFileExists(file_path):
+        return None
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
 
 
-def createJsonFile(file_path, data):
+def createJsonFile(file_path, data, sync=True):
     if checkFileExists(file_path):
         return False
-    return writeJsonFile(file_path, data)
+    return writeJsonFile(file_path, data, sync)
 
 
-def updateJsonFile(file_path, data):
+def updateJsonFile(file_path, data, sync=True):
     if not checkFileExists(file_path):
         return False
-    return writeJsonFile(file_path, data)
+    return writeJsonFile(file_path, data, sync)
     # return False
 
 
@@ -84,3 +197,28 @@ def printDict(data):
         print(yaml.dump(data, default_flow_style=False))
     else:
         print(data)
+
+
+# Appends all the records with a single write
+def appendJsonLines(file_path, records):
+    with open(file_path, "a") as file:
+        file.write("".join(json.dumps(data) + "\n" for data in records))
+        return True
+
+
+def loadJsonLines(file_path, offset=0):
+    records = []
+    if not checkFileExists(file_path):
+        return records, offset
+    with open(file_path, "r") as file:
+        file.seek(offset)
+        for line in iter(file.readline, ""):
+            # A torn last line means the writer crashed mid-append, stop there
+            if not line.endswith("\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+            offset = file.tell()
+    return records, offset
@@ -2,6 +2,9 @@ import cmd
 import argparse
 from ds.Database import Database
 from ds.utils import printDict
+from ds.Filters import parseFilter
+from ds.constants import BLOOM_ERROR_RATE, IO_WORKERS, IO_POOL_KIND, SERVER_ADDRESS, FSYNC_POLICIES, FSYNC_POLICY, FSYNC_INTERVAL_MS
+from ds.Server import serve, parseAddress
 import time
 from functools import wraps
 
@@ -21,9 +24,11 @@ def timing(func):
 class DSBase(cmd.Cmd):
     intro = "Welcome to DSBase. Type help or ? to list commands.\n"
 
-    def __init__(self, base_path):
+    def __init__(self, base_path, io_workers=IO_WORKERS, io_pool=IO_POOL_KIND, fsync_policy=FSYNC_POLICY,
+                 fsync_interval=FSYNC_INTERVAL_MS):
         super().__init__()
-        self.database: Database = Database(base_path)
+        self.database: Database = Database(base_path, io_workers=io_workers, io_pool=io_pool,
+                                           fsync_policy=fsync_policy, fsync_interval=fsync_interval)
         self.prompt = f"(dsbase: {base_path}) "  # Use base_path in the prompt
 
     #############################
@@ -57,14 +62,39 @@ class DSBase(cmd.Cmd):
         "Get the user of the database."
         print(self.database.get_whoami())
 
+    @timing
+    def do_cache_stats(self, arg):
+        "Get the hits, misses and size of the table and segment index cache."
+        printDict(self.database.get_cache_stats())
+
     #############################
     ###      DDL Commands     ###
     #############################
 
     @timing
     def do_create_table(self, arg):
-        "Create a table: create_table <table_name> <max_versions> <is_enabled: true> <column_family_names separated by space>"
+        "Create a table: create_table <table_name> <max_versions> <is_enabled: true> <column_family_names separated by space> [format=json|binary] [bloom=<false_positive_rate>] [ttl=<cf>:<seconds>,...]"
         args = arg.split()
+        storage_format = "json"
+        bloom_error_rate = BLOOM_ERROR_RATE
+        ttl = {}
+        while args and args[-1].startswith(("format=", "bloom=", "ttl=")):
+            key, _, value = args.pop().partition("=")
+            if key == "format":
+                storage_format = value
+                continue
+            if key == "ttl":
+                try:
+                    ttl = {cf: parseSeconds(seconds) for cf, _, seconds in (item.partition(":") for item in value.split(","))}
+                except ValueError:
+                    print("Error: ttl must be <cf>:<seconds>,...")
+                    return
+                continue
+            try:
+                bloom_error_rate = float(value)
+            except ValueError:
+                print("Error: bloom must be a number.")
+                return
         if len(args) < 4:
             print(
                 "Error: Specify table name, max_versions, is_enabled, and at least one column family name.")
@@ -79,11 +109,13 @@ class DSBase(cmd.Cmd):
         is_enabled = args[2].lower() == "true"
         column_families = args[3:]
 
-        if self.database.create_table(table_name, column_families, max_versions, is_enabled):
+        status, message = self.database.create_table(
+            table_name, column_families, max_versions, is_enabled, storage_format, bloom_error_rate, ttl)
+        if status:
             print(
-                f"Table {table_name} created with column families {column_families}. Max versions: {max_versions}. Is enabled: {is_enabled}.")
+                f"Table {table_name} created with column families {column_families}. Max versions: {max_versions}. Is enabled: {is_enabled}. Format: {storage_format}.")
         else:
-            print(f"Table {table_name} already exists.")
+            print(f"Error: {message}")
 
     @timing
     def do_list(self, arg):
@@ -159,7 +191,7 @@ class DSBase(cmd.Cmd):
 
     @timing
     def do_alter(self, arg):
-        "Alter a table: alter <table_name> <flag> <value>\nFlags: DELETE, RENAME, ADD\nIMPORTANT: Use ':' for old_col: new_col for RENAME flag."
+        "Alter a table: alter <table_name> <flag> <value>\nFlags: DELETE, RENAME, ADD, TTL\nIMPORTANT: Use ':' for old_col: new_col for RENAME flag, and col:seconds for TTL flag (0 to keep the versions forever)."
         args = arg.split()
         if len(args) < 3:
             print("Error: Specify table name, flag, and value.")
@@ -172,6 +204,30 @@ class DSBase(cmd.Cmd):
         else:
             print("Error altering table:", message)
 
+    @timing
+    def do_create_index(self, arg):
+        "Create an index on the values of a column: create_index <table_name> <column_family>:<column_qualifier>"
+        args = arg.split()
+        if len(args) != 2:
+            print("Error: Specify table name and column.")
+            return
+
+        table_name, column = args
+        status, message = self.database.create_index(table_name, column)
+        print(message if status else f"Error: {message}")
+
+    @timing
+    def do_drop_index(self, arg):
+        "Drop the index of a column: drop_index <table_name> <column_family>:<column_qualifier>"
+        args = arg.split()
+        if len(args) != 2:
+            print("Error: Specify table name and column.")
+            return
+
+        table_name, column = args
+        status, message = self.database.drop_index(table_name, column)
+        print(message if status else f"Error: {message}")
+
     #############################
     ###      DML Commands     ###
     #############################
@@ -195,16 +251,71 @@ class DSBase(cmd.Cmd):
         else:
             print(f"Error: {message}")
 
+    @timing
+    def do_check_and_put(self, arg):
+        "Put a value only if the column holds the expected one: check_and_put <table_name> <row_id> <column_family> <column_qualifier> <expected> <value>\nUse - as expected value for a column without value."
+        args = arg.split()
+        if len(args) != 6:
+            print(
+                "Error: Specify table name, row id, column family, column qualifier, expected value, and value.")
+            return
+
+        table_name, row_id, col_family, col_name, expected, value = args
+        status, message = self.database.check_and_put(
+            table_name, row_id, col_family, col_name, None if expected == '-' else expected, value)
+
+        if status:
+            print(
+                f"Put value {value} in table {table_name}. Row id: {row_id}. Column family: {col_family}. Column qualifier: {col_name}.")
+        else:
+            print(f"Error: {message}")
+
+    @timing
+    def do_increment(self, arg):
+        "Add to the integer value of a column: increment <table_name> <row_id> <column_family> <column_qualifier> [delta]"
+        args = arg.split()
+        if len(args) not in (4, 5):
+            print("Error: Specify table name, row id, column family, column qualifier, and optionally delta.")
+            return
+
+        table_name, row_id, col_family, col_name = args[:4]
+        delta = args[4] if len(args) == 5 else 1
+        status, value = self.database.increment(table_name, row_id, col_family, col_name, delta)
+
+        if status:
+            print(f"Incremented value in table {table_name}. Row id: {row_id}. Column family: {col_family}. Column qualifier: {col_name}. Value: {value}.")
+        else:
+            print(f"Error: {value}")
+
     @timing
     def do_get(self, arg):
-        "Get a value from a table: get <table_name> <row_id>"
+        "Get a value from a table: get <table_name> <row_id> [columns=<cf>,<cf:qualifier>,...] [versions=<latest versions per cell>] [time_range=<start>,<end>] [as_of=<timestamp>]\nVersions are write timestamps in milliseconds, time_range includes start and excludes end."
         args = arg.split()
         if len(args) < 2:
             print("Error: Specify table name and row id.")
             return
 
-        table_name, row_id = args
-        status, data = self.database.get(table_name, row_id)
+        table_name, row_id = args[:2]
+        columns = None
+        versions = None
+        time_options = {}
+        for option in args[2:]:
+            key, _, value = option.partition('=')
+            if key == 'columns' and value:
+                columns = value.split(',')
+            elif key == 'versions' and value:
+                versions = value
+            elif key in ['time_range', 'as_of'] and value:
+                time_options[key] = value
+            else:
+                print(f"Error: Invalid option {option}.")
+                return
+
+        status, time_range, as_of = parseTimeOptions(time_options)
+        if not status:
+            print(f"Error: {time_range}")
+            return
+        status, data = self.database.get(table_name, row_id, columns, versions, time_range, as_of)
 
         if status:
             print("Data:")
@@ -213,9 +324,23 @@ class DSBase(cmd.Cmd):
             print(data)
 
     @timing
-    def do_scan(self, arg):
-        "Scan a table: scan <table_name>"
-        status, data = self.database.scan(arg)
+    def do_get_many(self, arg):
+        "Get many rows of a table: get_many <table_name> <row_id> [<row_id> ...] [columns=<cf>,<cf:qualifier>,...]"
+        args = arg.split()
+        if len(args) < 2:
+            print("Error: Specify table name and row ids.")
+            return
+
+        table_name = args[0]
+        row_ids = []
+        columns = None
+        for value in args[1:]:
+            if value.startswith('columns='):
+                columns = value[len('columns='):].split(',')
+            else:
+                row_ids.append(value)
+
+        status, data = self.database.multi_get(table_name, row_ids, columns)
 
         if status:
             print("Data:")
@@ -223,6 +348,90 @@ class DSBase(cmd.Cmd):
         else:
             print(data)
 
+    @timing
+    def do_query(self, arg):
+        "Get the rows with a value in an indexed column: query <table_name> <column_family>:<column_qualifier> <value> [columns=<cf>,<cf:qualifier>,...] [limit=<n>]"
+        args = arg.split()
+        if len(args) < 3:
+            print("Error: Specify table name, column and value.")
+            return
+
+        table_name, column, value = args[:3]
+        options = {}
+        for option in args[3:]:
+            key, _, option_value = option.partition('=')
+            if key not in ['columns', 'limit'] or not option_value:
+                print(f"Error: Invalid option {option}.")
+                return
+            options[key] = option_value
+
+        limit = options.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                print("Error: limit must be an integer.")
+                return
+        columns = options['columns'].split(',') if 'columns' in options else None
+
+        status, data = self.database.query_index(table_name, column, value, columns, limit)
+
+        if status:
+            print("Data:")
+            printDict(data)
+        else:
+            print(data)
+
+    @timing
+    def do_scan(self, arg):
+        "Scan a table: scan <table_name> [start=<row_id>] [stop=<row_id>] [prefix=<row_prefix>] [limit=<n>] [columns=<cf>,<cf:qualifier>,...] [time_range=<start>,<end>] [as_of=<timestamp>] [filter=<filter> ...]\nFilters, all of which must pass: row~<regex>, qualifier<op><name>, value<op><value>, version>=<n>, version<=<n>, <cf>:<qualifier><op><value>\nwith <op> one of ==, !=, <, <=, >, >= or ~ for a regular expression."
+        args = arg.split()
+        if len(args) < 1:
+            print("Error: Specify table name.")
+            return
+
+        table_name = args[0]
+        options = {}
+        filters = []
+        for option in args[1:]:
+            key, _, value = option.partition('=')
+            if key == 'filter' and value:
+                try:
+                    filters.append(parseFilter(value))
+                except ValueError as error:
+                    print(f"Error: {error}.")
+                    return
+                continue
+            if key not in ['start', 'stop', 'prefix', 'limit', 'columns', 'time_range', 'as_of'] or not value:
+                print(f"Error: Invalid option {option}.")
+                return
+            options[key] = value
+
+        limit = options.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                print("Error: limit must be an integer.")
+                return
+        columns = options['columns'].split(',') if 'columns' in options else None
+        status, time_range, as_of = parseTimeOptions(options)
+        if not status:
+            print(f"Error: {time_range}")
+            return
+
+        status, rows = self.database.scan(table_name, start_row=options.get('start'), stop_row=options.get('stop'),
+                                          prefix=options.get('prefix'), limit=limit, columns=columns,
+                                          filters=filters or None, time_range=time_range, as_of=as_of)
+
+        if status:
+            # Rows are printed as they are read, the table is never held in memory
+            print("Data:")
+            for row_id, data in rows:
+                printDict({row_id: data})
+        else:
+            print(rows)
+
     @timing
     def do_delete(self, arg):
         "Delete a value from a table: delete <table_name> <row_id> <column_family> <column_qualifier> <version>"
@@ -260,20 +469,37 @@ class DSBase(cmd.Cmd):
 
     @timing
     def do_count(self, arg):
-        "Count the number of rows in a table: count <table_name>"
+        "Count the number of rows in a table: count <table_name> [--exact]\nUse --exact to count the rows again and repair the stored counter."
         args = arg.split()
         if len(args) < 1:
             print("Error: Specify table name.")
             return
 
         table_name = args[0]
-        status, count = self.database.count(table_name)
+        exact = "--exact" in args[1:]
+        status, count = self.database.count(table_name, exact)
 
         if status:
             print(f"Number of rows in table {table_name}: {count}")
         else:
             print(count)
 
+    @timing
+    def do_table_stats(self, arg):
+        "Get the number of rows and the number of cells of every column family of a table: table_stats <table_name> [--exact]"
+        args = arg.split()
+        if len(args) < 1:
+            print("Error: Specify table name.")
+            return
+
+        table_name = args[0]
+        status, stats = self.database.get_table_stats(table_name, "--exact" in args[1:])
+
+        if status:
+            printDict(stats)
+        else:
+            print(stats)
+
     @timing
     def do_truncate(self, arg):
         "Truncate a table: truncate <table_name>"
@@ -283,6 +509,39 @@ class DSBase(cmd.Cmd):
         else:
             print(f"Error: {message}")
 
+    @timing
+    def do_flush(self, arg):
+        "Write the pending operations of a table to its column family files: flush <table_name>"
+        status, message = self.database.flush(arg)
+        if status:
+            print(f"Table {arg} flushed.")
+        else:
+            print(f"Error: {message}")
+
+    @timing
+    def do_migrate(self, arg):
+        "Rewrite the column families of a table in another storage format: migrate <table_name> <json|binary>"
+        args = arg.split()
+        if len(args) != 2:
+            print("Error: Specify table name and storage format.")
+            return
+
+        table_name, storage_format = args
+        status, message = self.database.migrate_table(table_name, storage_format)
+        if status:
+            print(f"Table {table_name} migrated to {storage_format}.")
+        else:
+            print(f"Error: {message}")
+
+    @timing
+    def do_compact(self, arg):
+        "Merge the segments of every column family of a table: compact <table_name>"
+        status, message = self.database.compact(arg)
+        if status:
+            print(f"Table {arg} compacted.")
+        else:
+            print(f"Error: {message}")
+
     @timing
     def do_put_many(self, arg):
         "Put many values in a table: put_many <table_name> <file_path>"
@@ -295,15 +554,50 @@ class DSBase(cmd.Cmd):
         status, message = self.database.put_many(table_name, file_path)
 
         if status:
-            print(f"Values from {file_path} inserted into table {table_name}.")
+            print(f"Values from {file_path} inserted into table {table_name}. {message}")
         else:
             print(f"Error: {message}")
 
 
+def parseSeconds(text):
+    seconds = float(text)
+    return int(seconds) if seconds.is_integer() else seconds
+
+
+# (True, time_range, as_of) from the time_range=<start>,<end> and
+# as_of=<timestamp> options, or (False, message, None)
+def parseTimeOptions(options):
+    time_range = None
+    as_of = None
+    try:
+        if 'time_range' in options:
+            start, end = options['time_range'].split(',')
+            time_range = (int(start) if start else None, int(end) if end else None)
+        if 'as_of' in options:
+            as_of = int(options['as_of'])
+    except ValueError:
+        return False, "time_range must be <start>,<end> and as_of a timestamp in milliseconds.", None
+    return True, time_range, as_of
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="DSBase command line interface.")
     parser.add_argument("base_name", help="Name of the database.")
+    parser.add_argument("--io-workers", type=int, default=IO_WORKERS,
+                        help="Column families of a table read at the same time.")
+    parser.add_argument("--io-pool", choices=["thread", "process"], default=IO_POOL_KIND,
+                        help="Decode whole column families in threads or in processes.")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default=FSYNC_POLICY,
+                        help="When the writes reach the disk: on every command, in the background or when the system decides.")
+    parser.add_argument("--fsync-interval", type=int, default=FSYNC_INTERVAL_MS, metavar="MS",
+                        help="Longest delay of the background fsync of the 'batch' policy, in milliseconds.")
+    parser.add_argument("--serve", nargs="?", const=SERVER_ADDRESS, metavar="ADDRESS",
+                        help=f"Serve the database to clients on host:port or a Unix socket path instead of starting the shell (default {SERVER_ADDRESS}).")
     args = parser.parse_args()
 
-    DSBase(args.base_name).cmdloop()
+    if args.serve:
+        serve(args.base_name, parseAddress(args.serve), io_workers=args.io_workers, io_pool=args.io_pool,
+              fsync_policy=args.fsync, fsync_interval=args.fsync_interval)
+    else:
+        DSBase(args.base_name, args.io_workers, args.io_pool, args.fsync, args.fsync_interval).cmdloop()